@@ -0,0 +1,139 @@
+"""
+Нагрузка на SQLite-файл: писатели добавляют записи и комментарии,
+читатели открывают ленту. Сравнивает стандартный бэкенд Django
+с yatube.sqlite:
+
+    python -m benchmarks.concurrency --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = {
+    'stock': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}},
+    'production': {'ENGINE': 'yatube.sqlite', 'OPTIONS': {'timeout': 20}},
+}
+
+
+def percentile(values, share):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run_profile(profile, writers, readers, seconds):
+    """Выполняется в отдельном процессе: настройки базы задаются до setup."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    from django.conf import settings
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    settings.DATABASES['default'].update(PROFILES[profile], NAME=path)
+    settings.DATABASE_REPLICAS = []
+
+    import django
+    django.setup()
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db import connections
+    from django.test import Client
+    from django.urls import reverse
+
+    from posts.models import Post
+
+    call_command('migrate', verbosity=0)
+    User = get_user_model()
+    users = [
+        User.objects.create(username=f'writer{i}')
+        for i in range(writers)
+    ]
+    post = Post.objects.create(text='Benchmark', author=users[0])
+    results = {'write': [], 'read': [], 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(user):
+        client = Client(raise_request_exception=False)
+        if user is not None:
+            client.force_login(user)
+        kind = 'read' if user is None else 'write'
+        number = 0
+        while time.monotonic() < deadline:
+            number += 1
+            started = time.perf_counter()
+            if user is None:
+                response = client.get(reverse('index'))
+            elif number % 2:
+                response = client.post(
+                    reverse('new_post'), {'text': f'Post {number}'}
+                )
+            else:
+                response = client.post(
+                    reverse('add_comment', args=(post.author, post.pk)),
+                    {'text': f'Comment {number}'},
+                )
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if response.status_code >= 500:
+                    results['errors'] += 1
+                else:
+                    results[kind].append(elapsed)
+        connections.close_all()
+
+    threads = [
+        threading.Thread(target=worker, args=(user,)) for user in users
+    ] + [
+        threading.Thread(target=worker, args=(None,)) for _ in range(readers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'profile': profile,
+        'writes_per_s': round(len(results['write']) / seconds, 1),
+        'reads_per_s': round(len(results['read']) / seconds, 1),
+        'write_p95_ms': round(percentile(results['write'], 0.95), 1),
+        'read_p95_ms': round(percentile(results['read'], 0.95), 1),
+        'read_p50_ms': round(statistics.median(results['read'] or [0]), 1),
+        'errors': results['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profile', choices=PROFILES)
+    args = parser.parse_args()
+    if args.profile:
+        result = run_profile(
+            args.profile, args.writers, args.readers, args.seconds
+        )
+        print(json.dumps(result))
+        return
+
+    columns = (
+        'profile', 'writes_per_s', 'reads_per_s', 'write_p95_ms',
+        'read_p50_ms', 'read_p95_ms', 'errors',
+    )
+    print(''.join(f'{column:>14}' for column in columns))
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.concurrency',
+             '--profile', profile, '--writers', str(args.writers),
+             '--readers', str(args.readers), '--seconds', str(args.seconds)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(''.join(f'{result[column]!s:>14}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+VOLUMES = {
+    'users': int(os.environ.get('BENCH_USERS', 50)),
+    'posts': int(os.environ.get('BENCH_POSTS', 2000)),
+    'comments': int(os.environ.get('BENCH_COMMENTS', 2000)),
+    'follows': int(os.environ.get('BENCH_FOLLOWS', 200)),
+}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption(
+        '--bench-save', action='store_true',
+        help='Сохранить результаты как новый baseline',
+    )
+    group.addoption(
+        '--bench-rounds', type=int, default=5,
+        help='Сколько раз запрашивать каждый адрес',
+    )
+
+
+def seed(users, posts, comments, follows):
+    """Создаёт данные пачками, минуя сигналы, и пересчитывает производные."""
+    from django.contrib.auth import get_user_model
+    from posts import counters, lookups, search, timeline
+    from posts.models import Comment, Follow, Group, Post
+
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username=f'bench{i}', first_name=f'User {i}')
+         for i in range(users)],
+        batch_size=500,
+    )
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    groups = Group.objects.bulk_create(
+        [Group(title=f'Group {i}', slug=f'bench-group-{i}')
+         for i in range(5)]
+    )
+    group_ids = list(Group.objects.values_list('pk', flat=True))
+    Post.objects.bulk_create(
+        [Post(text=f'Benchmark post {i}\nsecond line',
+              author_id=user_ids[i % len(user_ids)],
+              group_id=group_ids[i % len(groups)] if i % 3 else None)
+         for i in range(posts)],
+        batch_size=500,
+    )
+    # первая по pk запись — та, что открывают маршруты post и post_comments
+    post_ids = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+    Comment.objects.bulk_create(
+        [Comment(text=f'Comment {i}',
+                 author_id=user_ids[i % len(user_ids)],
+                 post_id=post_ids[i % 10])
+         for i in range(comments)],
+        batch_size=500,
+    )
+    pairs = set()
+    for i in range(follows):
+        user_id = user_ids[i % len(user_ids)]
+        author_id = user_ids[(i * 7 + 1) % len(user_ids)]
+        if user_id != author_id:
+            pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=u, author_id=a) for u, a in pairs],
+        batch_size=500,
+    )
+    counters.recount_posts()
+    counters.recount_users()
+    timeline.rebuild()
+    search.reindex()
+    lookups.usernames.rebuild()
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker):
+    with django_db_blocker.unblock():
+        seed(**VOLUMES)
+
+
+def pytest_sessionfinish(session):
+    from benchmarks.runner import RESULTS, save_baseline
+    if session.config.getoption('--bench-save') and RESULTS:
+        save_baseline(RESULTS)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    from benchmarks.runner import RESULTS
+    if not RESULTS:
+        return
+    terminalreporter.section('yatube benchmarks')
+    terminalreporter.write_line(
+        f'{"route":<22}{"p50 ms":>10}{"p95 ms":>10}{"queries":>10}'
+        f'{"bytes":>10}'
+    )
+    for name, row in sorted(RESULTS.items()):
+        terminalreporter.write_line(
+            f'{name:<22}{row["p50_ms"]:>10.2f}{row["p95_ms"]:>10.2f}'
+            f'{row["queries"]:>10}{row["bytes"]:>10}'
+        )
@@ -0,0 +1,78 @@
+import json
+import os
+import statistics
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+LATENCY_TOLERANCE = os.environ.get('BENCH_LATENCY_TOLERANCE')
+
+RESULTS = {}
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[index]
+
+
+def measure(name, request, rounds):
+    """
+    Выполняет запрос rounds раз с пустым кэшем, чтобы мерить полный
+    путь отрисовки, и сохраняет p50/p95, число запросов к БД и размер.
+    """
+    timings = []
+    queries = []
+    size = 0
+    for _ in range(rounds):
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = request()
+            timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code < 400, (name, response.status_code)
+        queries.append(len(captured))
+        size = len(response.content)
+    RESULTS[name] = {
+        'p50_ms': statistics.median(timings),
+        'p95_ms': percentile(timings, 95),
+        'queries': max(queries),
+        'bytes': size,
+    }
+    return RESULTS[name]
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def save_baseline(results):
+    baseline = load_baseline()
+    baseline[connection.vendor] = {
+        name: {'queries': row['queries'], 'p95_ms': round(row['p95_ms'], 2)}
+        for name, row in sorted(results.items())
+    }
+    with open(BASELINE_PATH, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check_regression(name, result):
+    expected = load_baseline().get(connection.vendor, {}).get(name)
+    if expected is None:
+        return
+    assert result['queries'] <= expected['queries'], (
+        f'{name}: {result["queries"]} запросов к БД, '
+        f'в baseline {expected["queries"]}'
+    )
+    if LATENCY_TOLERANCE:
+        limit = expected['p95_ms'] * float(LATENCY_TOLERANCE)
+        assert result['p95_ms'] <= limit, (
+            f'{name}: p95 {result["p95_ms"]:.1f} мс, допустимо {limit:.1f} мс'
+        )
@@ -0,0 +1,85 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from benchmarks.runner import check_regression, measure
+from posts import urls as posts_urls
+from posts.models import Group, Post
+
+User = get_user_model()
+
+# имя замера: (имя маршрута, метод, нужен ли вход, аргументы)
+ROUTES = {
+    'index': ('index', 'get', False, lambda d: ()),
+    'index_auth': ('index', 'get', True, lambda d: ()),
+    'group': ('group', 'get', False, lambda d: (d['group'].slug,)),
+    'new_post': ('new_post', 'get', True, lambda d: ()),
+    'follow_index': ('follow_index', 'get', True, lambda d: ()),
+    'profile': ('profile', 'get', False, lambda d: (d['author'].username,)),
+    'profile_follow': (
+        'profile_follow', 'get', True, lambda d: (d['other'].username,)
+    ),
+    'profile_unfollow': (
+        'profile_unfollow', 'get', True, lambda d: (d['other'].username,)
+    ),
+    'post': (
+        'post', 'get', False,
+        lambda d: (d['author'].username, d['post'].pk),
+    ),
+    'post_comments': (
+        'post_comments', 'get', False,
+        lambda d: (d['author'].username, d['post'].pk),
+    ),
+    'post_edit': (
+        'post_edit', 'get', True,
+        lambda d: (d['author'].username, d['post'].pk),
+    ),
+    'add_comment': (
+        'add_comment', 'post', True,
+        lambda d: (d['author'].username, d['post'].pk),
+    ),
+    'search': ('search', 'get', False, lambda d: ()),
+    'follow_batch': ('follow_batch', 'post', True, lambda d: ()),
+}
+
+# данные запроса для замеров, которым они нужны
+REQUEST_DATA = {
+    'search': lambda d: {'q': 'benchmark post'},
+    'follow_batch': lambda d: {
+        'follow': [d['other'].username], 'unfollow': [],
+    },
+}
+
+
+@pytest.fixture
+def bench_data(db):
+    post = Post.objects.order_by('pk').select_related('author').first()
+    return {
+        'post': post,
+        'author': post.author,
+        'other': User.objects.exclude(pk=post.author_id).first(),
+        'group': Group.objects.first(),
+    }
+
+
+def test_every_route_is_benchmarked():
+    covered = {route[0] for route in ROUTES.values()}
+    names = {pattern.name for pattern in posts_urls.urlpatterns}
+    assert names <= covered, f'Нет замеров для {sorted(names - covered)}'
+
+
+@pytest.mark.parametrize('name', sorted(ROUTES))
+def test_route(name, bench_data, client, request):
+    url_name, method, login, args = ROUTES[name]
+    if login:
+        client.force_login(bench_data['author'])
+    url = reverse(url_name, args=args(bench_data))
+    data = {'text': 'Benchmark comment'} if method == 'post' else None
+    if name in REQUEST_DATA:
+        data = REQUEST_DATA[name](bench_data)
+
+    def do_request():
+        return getattr(client, method)(url, data)
+
+    result = measure(name, do_request, request.config.getoption('--bench-rounds'))
+    check_regression(name, result)
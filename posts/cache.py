@@ -0,0 +1,120 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+FEED_CACHE_TIMEOUT = getattr(settings, 'FEED_CACHE_TIMEOUT', 300)
+POST_CACHE_TIMEOUT = getattr(settings, 'POST_CACHE_TIMEOUT', 60 * 60 * 24)
+GENERATION_KEY = 'feed:generation'
+VERSION_KEY = 'post_item:version:%s:%s'
+
+
+def get_versions(keys):
+    """
+    Версии для ключей кэша одним get_many. Пропавшая версия заводится
+    заново от текущего времени, а не с нуля, чтобы не совпасть
+    с одной из прежних.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+
+def get_generation():
+    """
+    Поколение лент: входит в ключи кэша фрагментов и меняется при
+    любой записи, поэтому устаревшие фрагменты просто не читаются.
+    """
+    return get_versions([GENERATION_KEY])[GENERATION_KEY]
+
+
+def bump_generation():
+    bump_version(GENERATION_KEY)
+
+
+def bump_author_version(author_id):
+    bump_version(VERSION_KEY % ('author', author_id))
+
+
+def bump_group_version(group_id):
+    bump_version(VERSION_KEY % ('group', group_id))
+
+
+def page_etag(request, *args, **kwargs):
+    """
+    Валидатор для условного GET: поколение лент меняется при любой
+    записи, включая комментарии и подписки, которые не видны
+    по pub_date. Страница зависит и от пользователя (ссылки
+    редактирования, кнопка подписки). Last-Modified не отдаётся:
+    с точностью до секунды две записи подряд его не меняют, и запрос
+    только с If-Modified-Since получил бы 304 на устаревшую страницу.
+    """
+    user = request.user.pk if request.user.is_authenticated else 0
+    return f'{get_generation()}-{user}'
+
+
+def page_key(page):
+    """Номер страницы или курсор: str(Page) для ключа не годится."""
+    return str(page.number or page.cursor)
+
+
+def feed_cache_context(page):
+    return {
+        'feed_cache_timeout': FEED_CACHE_TIMEOUT,
+        'feed_generation': get_generation(),
+        'page_key': page_key(page),
+    }
+
+
+def item_version_keys(post):
+    keys = [VERSION_KEY % ('author', post.author_id)]
+    if post.group_id:
+        keys.append(VERSION_KEY % ('group', post.group_id))
+    return keys
+
+
+def post_item_key(post, user, versions):
+    """
+    Версия записи — post.updated (редактирование, новый комментарий)
+    и версии автора и группы: их изменение не переписывает записи.
+    """
+    is_author = user is not None and user.pk == post.author_id
+    return 'post_item:%s:%s:%s:%d' % (
+        post.pk, post.updated.timestamp(),
+        ':'.join(str(versions[key]) for key in item_version_keys(post)),
+        is_author,
+    )
+
+
+def render_post_items(posts, user):
+    """
+    Отрисовывает записи, забирая версии авторов и групп и готовый
+    HTML двумя get_many.
+    """
+    versions = get_versions(list({
+        key for post in posts for key in item_version_keys(post)
+    }))
+    keys = [(post_item_key(post, user, versions), post) for post in posts]
+    rendered = cache.get_many([key for key, post in keys])
+    missing = {}
+    for key, post in keys:
+        if key not in rendered:
+            missing[key] = render_to_string(
+                'include/post_item.html', {'post': post, 'user': user}
+            )
+    if missing:
+        cache.set_many(missing, POST_CACHE_TIMEOUT)
+        rendered.update(missing)
+    return mark_safe(''.join(rendered[key] for key, post in keys))
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AuthorStats, Comment, Follow, Post
+
+User = get_user_model()
+
+
+def change_post_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F('comment_count') + delta,
+        updated=timezone.now(),
+    )
+
+
+def change_user_counter(user_id, field, delta):
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta}
+    )
+
+
+def count_subquery(queryset, field):
+    counts = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def recount_posts(post_ids=None):
+    """Пересчитывает Post.comment_count одним UPDATE."""
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    return posts.update(
+        comment_count=count_subquery(Comment.objects.all(), 'post'),
+        updated=timezone.now(),
+    )
+
+
+def recount_users(user_ids=None):
+    """Создаёт недостающие AuthorStats и пересчитывает счётчики авторов."""
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in users.values_list('pk', flat=True)],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    stats = AuthorStats.objects.all()
+    if user_ids is not None:
+        stats = stats.filter(user_id__in=user_ids)
+    return stats.update(
+        followers_count=count_subquery(Follow.objects.all(), 'author'),
+        following_count=count_subquery(Follow.objects.all(), 'user'),
+        posts_count=count_subquery(Post.objects.all(), 'author'),
+    )
+
+
+def recount_follows(user_id, author_ids):
+    """
+    Пересчитывает по строкам Follow подписки пользователя и подписчиков
+    авторов: после bulk_create(ignore_conflicts=True) неизвестно,
+    какие строки вставлены на самом деле.
+    """
+    follows = Follow.objects.all()
+    AuthorStats.objects.filter(user_id__in=author_ids).update(
+        followers_count=count_subquery(follows, 'author')
+    )
+    AuthorStats.objects.filter(user_id=user_id).update(
+        following_count=count_subquery(follows, 'user')
+    )
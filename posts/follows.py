@@ -0,0 +1,108 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import cache as feed_cache
+from . import counters, pagecache, timeline
+from .models import Follow, TimelineEntry
+
+User = get_user_model()
+
+MAX_BATCH = getattr(settings, 'FOLLOW_BATCH_MAX', 100)
+RATE_LIMIT = getattr(settings, 'FOLLOW_RATE_LIMIT', 300)
+RATE_WINDOW = getattr(settings, 'FOLLOW_RATE_WINDOW', 60)
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def check_rate(user_id, amount):
+    """Не больше RATE_LIMIT изменений подписок за окно RATE_WINDOW секунд."""
+    window = int(time.time() // RATE_WINDOW)
+    key = f'follow-rate:{user_id}:{window}'
+    cache.add(key, 0, RATE_WINDOW)
+    try:
+        used = cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, RATE_WINDOW)
+        used = amount
+    if used > RATE_LIMIT:
+        raise RateLimitExceeded(RATE_WINDOW * (window + 1) - int(time.time()))
+
+
+def delete_follows(user, author_ids):
+    """Один DELETE без выборки объектов и сигналов post_delete."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM %s WHERE user_id = %%s AND author_id IN (%s)' % (
+                connection.ops.quote_name(Follow._meta.db_table),
+                ', '.join(['%s'] * len(author_ids)),
+            ),
+            [user.pk, *author_ids],
+        )
+
+
+def apply(user, follow=(), unfollow=()):
+    """
+    Подписывает пользователя на авторов из follow и отписывает от авторов
+    из unfollow (списки username) одной транзакцией: один bulk_create,
+    один DELETE. Сигналы не срабатывают, поэтому счётчики, ленты и кэш
+    обновляются здесь же. Возвращает username добавленных и удалённых
+    подписок.
+    """
+    follow, unfollow = set(follow), set(unfollow) - set(follow)
+    if len(follow) + len(unfollow) > MAX_BATCH:
+        raise BatchTooLarge(MAX_BATCH)
+    check_rate(user.pk, len(follow) + len(unfollow))
+    authors = dict(
+        User.objects.filter(
+            username__in=follow | unfollow
+        ).exclude(pk=user.pk).values_list('pk', 'username')
+    )
+    with transaction.atomic():
+        current = set(
+            Follow.objects.filter(
+                user=user, author_id__in=authors
+            ).values_list('author_id', flat=True)
+        )
+        added = [
+            pk for pk, name in authors.items()
+            if name in follow and pk not in current
+        ]
+        removed = [
+            pk for pk, name in authors.items()
+            if name in unfollow and pk in current
+        ]
+        Follow.objects.bulk_create(
+            [Follow(user=user, author_id=pk) for pk in added],
+            ignore_conflicts=True,
+        )
+        if removed:
+            delete_follows(user, removed)
+            TimelineEntry.objects.filter(
+                user=user, post__author_id__in=removed
+            ).delete()
+        if added or removed:
+            counters.recount_follows(user.pk, added + removed)
+        for author_id in added:
+            timeline.backfill(user.pk, author_id)
+    if added or removed:
+        feed_cache.bump_generation()
+        pagecache.purge(
+            f'author-{user.pk}',
+            *(f'author-{pk}' for pk in added + removed),
+        )
+    return (
+        sorted(authors[pk] for pk in added),
+        sorted(authors[pk] for pk in removed),
+    )
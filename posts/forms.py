@@ -1,6 +1,8 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm, Textarea, ValidationError
 from django.utils.translation import gettext_lazy as _
 
+from .images import process_upload
 from .models import Comment, Post
 
 
@@ -14,6 +16,12 @@ class PostForm(ModelForm):
             'image': _('Вы можете загрузить изображение для своего поста'),
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return process_upload(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
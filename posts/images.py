@@ -0,0 +1,49 @@
+import os
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.utils.translation import gettext_lazy as _
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_PIXELS = getattr(settings, 'MAX_UPLOAD_PIXELS', 40 * 1000 * 1000)
+MAX_IMAGE_SIDE = getattr(settings, 'MAX_IMAGE_SIDE', 1920)
+IMAGE_QUALITY = getattr(settings, 'IMAGE_QUALITY', 85)
+SPOOL_SIZE = 1024 * 1024
+
+
+def process_upload(upload):
+    """
+    Проверяет размеры по заголовку файла, уменьшает изображение до
+    MAX_IMAGE_SIDE и перекодирует его без метаданных: JPEG, а при
+    наличии прозрачности — WebP. Результат не держится в памяти
+    целиком: больше SPOOL_SIZE он уходит во временный файл.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if width * height > MAX_UPLOAD_PIXELS:
+        raise ValidationError(
+            _('Изображение слишком большое: %(width)s×%(height)s'),
+            code='image_too_large',
+            params={'width': width, 'height': height},
+        )
+    if image.format == 'JPEG':
+        # декодирование сразу в уменьшенном масштабе
+        image.draft('RGB', (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image_format, extension = 'WEBP', '.webp'
+        image = image.convert('RGBA')
+    else:
+        image_format, extension = 'JPEG', '.jpg'
+        image = image.convert('RGB')
+
+    output = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    image.save(output, image_format, quality=IMAGE_QUALITY, optimize=True)
+    output.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return File(output, name=name)
@@ -0,0 +1,224 @@
+"""
+Группа по slug и автор по username без запроса к базе: найденные
+объекты лежат в кэше по умолчанию (TieredCache — LRU в памяти
+процесса поверх общего кэша). Записи сбрасываются сигналами
+сохранения и удаления Group и User.
+
+Несуществующие slug, username и записи тоже кэшируются на
+NEGATIVE_TIMEOUT, а username сначала проверяются фильтром Блума:
+адреса, которые перебирают сканеры, получают 404 без базы.
+
+Промахи кэша читаются с основной базы, даже если запрос идёт
+на реплику: отставшая реплика не должна попасть в кэш на час.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .models import Group
+
+User = get_user_model()
+
+LOOKUP_TIMEOUT = getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 60 * 60)
+NEGATIVE_TIMEOUT = getattr(settings, 'LOOKUP_NEGATIVE_TIMEOUT', 60)
+BLOOM_ERROR_RATE = getattr(settings, 'USERNAME_BLOOM_ERROR_RATE', 0.01)
+# без пароля, почты и флагов: только то, что нужно страницам
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name')
+MISSING = 'missing'
+USERNAMES_VERSION_KEY = 'lookup:usernames-version'
+# отстав больше чем на столько имён, процесс перестраивает фильтр
+USERNAMES_CATCH_UP = 100
+
+
+class BloomFilter:
+    """Множество без ложноотрицательных ответов; ложноположительных
+    не больше error_rate, пока добавлено не больше capacity значений."""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = max(capacity, 1)
+        self.size = max(64, math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & 1 << (position & 7)
+            for position in self.positions(value)
+        )
+
+
+class UsernameFilter:
+    """
+    Фильтр Блума всех username в памяти процесса. Строится при первой
+    проверке после запуска, новые имена добавляет сигнал сохранения
+    User. Каждое имя публикуется в общем кэше под своей версией: другие
+    процессы добирают пропущенные имена и перестраивают фильтр, только
+    если их нет. wsgi.py строит фильтр до первого запроса.
+    """
+
+    def __init__(self):
+        self.bloom = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def rebuild(self, version=None):
+        names = list(User.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'username', flat=True
+        ))
+        bloom = BloomFilter(len(names) * 2 + 1000)
+        for name in names:
+            bloom.add(name)
+        self.bloom, self.version = bloom, version
+
+    def catch_up(self, version):
+        """Добавляет имена, опубликованные после self.version."""
+        if (self.version is None
+                or not 0 < version - self.version <= USERNAMES_CATCH_UP):
+            return False
+        keys = [
+            username_key(number)
+            for number in range(self.version + 1, version + 1)
+        ]
+        names = cache.get_many(keys)
+        if len(names) < len(keys):
+            return False
+        for name in names.values():
+            self.bloom.add(name)
+        self.version = version
+        return True
+
+    def might_exist(self, username):
+        version = cache.get(USERNAMES_VERSION_KEY)
+        with self.lock:
+            if (self.bloom is None or self.bloom.count >= self.bloom.capacity
+                    or version is not None and version != self.version
+                    and not self.catch_up(version)):
+                self.rebuild(version)
+            return username in self.bloom
+
+    def add(self, username):
+        """Новое имя: вызывается при создании и переименовании User."""
+        version = usernames_changed()
+        cache.set(username_key(version), username, LOOKUP_TIMEOUT)
+        with self.lock:
+            if self.bloom is None:
+                return
+            self.bloom.add(username)
+            # версия сдвинулась только из-за этого имени
+            if self.version is not None and self.version + 1 == version:
+                self.version = version
+
+    def reset(self):
+        with self.lock:
+            self.bloom = self.version = None
+
+
+usernames = UsernameFilter()
+
+
+def usernames_changed():
+    """Просит все процессы перестроить фильтр; нужна после загрузки
+    пользователей в обход сигналов."""
+    try:
+        return cache.incr(USERNAMES_VERSION_KEY)
+    except ValueError:
+        cache.add(USERNAMES_VERSION_KEY, int(time.time() * 1000), None)
+        return cache.get(USERNAMES_VERSION_KEY)
+
+
+def username_key(version):
+    return f'lookup:usernames:{version}'
+
+
+def group_key(slug):
+    return f'lookup:group:{slug}'
+
+
+def user_key(username):
+    return f'lookup:user:{username}'
+
+
+def missing_post_key(author_id, post_id):
+    return f'lookup:no-post:{author_id}:{post_id}'
+
+
+def lookup(key, queryset, **filters):
+    record = cache.get(key)
+    if record == MISSING:
+        raise Http404
+    if record is None:
+        try:
+            record = get_object_or_404(
+                queryset.using(DEFAULT_DB_ALIAS), **filters
+            )
+        except Http404:
+            cache.set(key, MISSING, NEGATIVE_TIMEOUT)
+            raise
+        cache.set(key, record, LOOKUP_TIMEOUT)
+    return record
+
+
+def get_group(slug):
+    return lookup(group_key(slug), Group.objects.all(), slug=slug)
+
+
+def get_user(username):
+    """Автор с полями USER_FIELDS; остальные загрузятся при обращении."""
+    if not usernames.might_exist(username):
+        raise Http404
+    return lookup(
+        user_key(username), User.objects.only(*USER_FIELDS),
+        username=username,
+    )
+
+
+def get_post(queryset, author, post_id):
+    """
+    Запись автора; несуществующие id помнятся NEGATIVE_TIMEOUT. Промах
+    на реплике перепроверяется на основной базе: реплика могла ещё
+    не получить новую запись.
+    """
+    key = missing_post_key(author.pk, post_id)
+    if cache.get(key) == MISSING:
+        raise Http404
+    try:
+        return get_object_or_404(queryset, author=author, pk=post_id)
+    except Http404:
+        if queryset.db != DEFAULT_DB_ALIAS:
+            return get_post(queryset.using(DEFAULT_DB_ALIAS), author, post_id)
+        cache.set(key, MISSING, NEGATIVE_TIMEOUT)
+        raise
+
+
+def forget_groups(*slugs):
+    cache.delete_many([group_key(slug) for slug in slugs])
+
+
+def forget_users(*names):
+    cache.delete_many([user_key(name) for name in names])
+
+
+def forget_missing_post(author_id, post_id):
+    cache.delete(missing_post_key(author_id, post_id))
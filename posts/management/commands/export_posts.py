@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = 'Выгружает записи, комментарии или подписки в JSONL или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output', nargs='?', default='-',
+            help='Файл; по умолчанию — стандартный вывод',
+        )
+        parser.add_argument(
+            '--kind', choices=transfer.FIELDS, default='posts',
+        )
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS,
+            help='По умолчанию — по расширению файла, иначе jsonl',
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        fmt = options['format'] or guess_format(output)
+        rows = transfer.export_rows(options['kind'])
+        if output == '-':
+            count = transfer.write_rows(options['kind'], rows, self.stdout, fmt)
+        else:
+            with open(output, 'w', encoding='utf-8', newline='') as stream:
+                count = transfer.write_rows(options['kind'], rows, stream, fmt)
+        sys.stderr.write(f'Выгружено строк: {count}\n')
+
+
+def guess_format(path):
+    return 'csv' if path.endswith('.csv') else 'jsonl'
@@ -0,0 +1,50 @@
+import logging
+import os
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import generate
+
+logger = logging.getLogger(__name__)
+
+
+def generate_safe(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+        return False
+    finally:
+        connections.close_all()
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры всех размеров для изображений записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; по умолчанию — по числу ядер',
+        )
+        parser.add_argument('--chunk-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # дочерние процессы откроют собственные соединения с БД
+        connections.close_all()
+        done = failed = 0
+        with Pool(processes=options['workers']) as pool:
+            names = Post.objects.exclude(image='').exclude(
+                image__isnull=True
+            ).order_by().values_list('image', flat=True).distinct()
+            for ok in pool.imap_unordered(
+                generate_safe, names.iterator(), chunksize=options['chunk_size']
+            ):
+                if ok:
+                    done += 1
+                else:
+                    failed += 1
+        self.stdout.write(f'Готово: {done}, с ошибками: {failed}')
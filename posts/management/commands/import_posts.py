@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+from .export_posts import guess_format
+
+
+class Command(BaseCommand):
+    help = 'Загружает записи, комментарии или подписки из JSONL или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input', help='Файл или «-» для стандартного ввода',
+        )
+        parser.add_argument(
+            '--kind', choices=transfer.FIELDS, default='posts',
+        )
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS,
+            help='По умолчанию — по расширению файла, иначе jsonl',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=transfer.BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        path = options['input']
+        fmt = options['format'] or guess_format(path)
+        if path == '-':
+            count = self.load(sys.stdin, fmt, options)
+        else:
+            with open(path, encoding='utf-8', newline='') as stream:
+                count = self.load(stream, fmt, options)
+        transfer.refresh_derived(options['kind'])
+        self.stdout.write(f'Загружено строк: {count}')
+
+    def load(self, stream, fmt, options):
+        return transfer.import_rows(
+            options['kind'],
+            transfer.read_rows(stream, fmt),
+            options['batch_size'],
+        )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики комментариев, подписок и записей'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            posts = counters.recount_posts()
+            users = counters.recount_users()
+        self.stdout.write(
+            f'Пересчитано записей: {posts}, авторов: {users}'
+        )
@@ -0,0 +1,74 @@
+# Generated by Django 2.2.6 on 2026-10-18 08:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicate_follows(apps, schema_editor):
+    # до unique_following и до подсчёта подписчиков: оставляем первую
+    # подписку каждой пары (user, author)
+    Follow = apps.get_model('posts', 'Follow')
+    duplicates = Follow.objects.order_by().values('user', 'author').annotate(
+        total=Count('pk'), first=Min('pk')
+    ).filter(total__gt=1)
+    for row in duplicates:
+        Follow.objects.filter(
+            user=row['user'], author=row['author']
+        ).exclude(pk=row['first']).delete()
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+
+    # один UPDATE, как counters.recount_posts
+    comments = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by().values('post').annotate(total=Count('pk')).values('total')
+    Post.objects.update(comment_count=Coalesce(Subquery(comments), 0))
+
+    stats = {pk: AuthorStats(user_id=pk) for pk in User.objects.values_list('pk', flat=True)}
+    for row in Post.objects.order_by().values('author').annotate(total=Count('pk')):
+        stats[row['author']].posts_count = row['total']
+    for row in Follow.objects.order_by().values('author').annotate(total=Count('pk')):
+        stats[row['author']].followers_count = row['total']
+    for row in Follow.objects.order_by().values('user').annotate(total=Count('pk')):
+        stats[row['user']].following_count = row['total']
+    AuthorStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0007_follow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество комментариев'),
+        ),
+        migrations.RunPython(delete_duplicate_follows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_following'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from posts import search
+
+
+def create_search_index(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    connection = schema_editor.connection
+    search.create_index(connection)
+    rows = Post.objects.order_by('pk').values_list('pk', 'text', 'group__title')
+    batch = []
+    for row in rows.iterator():
+        batch.append(row)
+        if len(batch) >= 500:
+            search.index_posts(batch, connection)
+            batch = []
+    search.index_posts(batch, connection)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.6 on 2026-10-18 09:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrity_gaps(apps, schema_editor):
+    # до этой миграции записи знаменитостей по лентам не раскладывались
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    AuthorStats.objects.filter(
+        followers_count__gt=getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+    ).update(timeline_gaps=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_recommendation'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timelineentry',
+            name='timeline_user_date_idx',
+        ),
+        migrations.AddField(
+            model_name='authorstats',
+            name='timeline_gaps',
+            field=models.BooleanField(default=False, verbose_name='Пропуски в лентах'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_date_post_idx'),
+        ),
+        migrations.RunPython(mark_celebrity_gaps, migrations.RunPython.noop),
+    ]
@@ -33,12 +33,28 @@ class Post(models.Model):
         related_name='posts',
     )
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    comment_count = models.PositiveIntegerField(
+        'Количество комментариев',
+        default=0,
+        editable=False,
+    )
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
 
     def __str__(self):
         return self.text
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date_idx',
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -63,6 +79,12 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx',
+            ),
+        ]
 
 
 class Follow(models.Model):
@@ -83,3 +105,85 @@ class Follow(models.Model):
                 fields=['user', 'author'], name='unique_following'
             )
         ]
+        # unique_following покрывает поиск по (user, author),
+        # этот индекс — выборку подписчиков автора
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            ),
+        ]
+
+
+class AuthorStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+    )
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    posts_count = models.PositiveIntegerField('Записей', default=0)
+    # записи автора не разложены по лентам части подписчиков:
+    # ленты читают его записи при запросе, пока rebuild не восполнит
+    timeline_gaps = models.BooleanField('Пропуски в лентах', default=False)
+
+    def __str__(self):
+        return str(self.user)
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_date_post_idx',
+            )
+        ]
+
+
+class Recommendation(models.Model):
+    """Рекомендации «на кого подписаться», считаются командой
+    compute_recommendations."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    score = models.PositiveIntegerField('Вес')
+
+    class Meta:
+        ordering = ('-score',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'], name='unique_recommendation'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-score'], name='recommendation_user_idx'
+            )
+        ]
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.module_loading import import_string
+
+from .cache import get_generation
+from .models import Post
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+PAGE_CACHE_MAX_AGE = getattr(settings, 'PAGE_CACHE_MAX_AGE', 60)
+SAFE_METHODS = ('GET', 'HEAD')
+
+logger = logging.getLogger(__name__)
+
+
+def edge_backend():
+    """Функция PAGE_CACHE_PURGE_BACKEND(keys), сбрасывающая ключи в CDN."""
+    path = getattr(settings, 'PAGE_CACHE_PURGE_BACKEND', None)
+    return import_string(path) if path else None
+
+
+def edge_max_age():
+    """Без сброса в CDN страница живёт там не дольше, чем в браузере."""
+    if edge_backend() is None:
+        return PAGE_CACHE_MAX_AGE
+    return PAGE_CACHE_TIMEOUT
+
+
+def object_keys(obj):
+    """Ключи записи или комментария на странице: автор, запись, группа."""
+    keys = {f'author-{obj.author_id}'}
+    if isinstance(obj, Post):
+        keys.add(f'post-{obj.pk}')
+        if obj.group_id:
+            keys.add(f'group-{obj.group_id}')
+    return keys
+
+
+def set_surrogate_keys(response, keys):
+    response['Surrogate-Key'] = ' '.join(sorted(keys))
+    return response
+
+
+def version_key(key):
+    return f'surrogate:{key}'
+
+
+def key_versions(keys):
+    versions = cache.get_many([version_key(key) for key in keys])
+    for key in keys:
+        if version_key(key) not in versions:
+            cache.add(version_key(key), int(time.time() * 1000), None)
+            versions[version_key(key)] = cache.get(version_key(key))
+    return {key: versions[version_key(key)] for key in keys}
+
+
+def purge(*keys):
+    """
+    Сбрасывает страницы с этими Surrogate-Key: у каждого ключа своя
+    версия, сохранённая страница с устаревшей версией не отдаётся.
+    Ключи передаются и в PAGE_CACHE_PURGE_BACKEND.
+    """
+    for key in keys:
+        try:
+            cache.incr(version_key(key))
+        except ValueError:
+            cache.add(version_key(key), int(time.time() * 1000), None)
+    backend = edge_backend()
+    if backend is not None and keys:
+        purge_edge(backend, keys)
+
+
+def purge_on_commit(*keys):
+    """purge() после коммита: раньше страницу заново сохранил бы
+    читатель, который ещё видит старые строки."""
+    transaction.on_commit(lambda: purge(*keys))
+
+
+def purge_edge(backend, keys):
+    # недоступный CDN не должен ломать запись: страница истечёт сама
+    try:
+        backend(sorted(set(keys)))
+    except Exception:
+        logger.exception('Не удалось сбросить ключи CDN %s', keys)
+
+
+def page_key(request):
+    url = request.build_absolute_uri()
+    return 'page:' + hashlib.md5(url.encode()).hexdigest()
+
+
+def anonymous_page_cache(view):
+    """
+    Разрешает сохранить ответ для анонимных посетителей: ставит
+    публичный Cache-Control для CDN, а AnonymousPageCacheMiddleware
+    кладёт страницу в кэш с её Surrogate-Key.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if (request.user.is_anonymous and response.status_code == 200
+                and response.has_header('Surrogate-Key')):
+            patch_cache_control(
+                response, public=True, max_age=PAGE_CACHE_MAX_AGE,
+                s_maxage=edge_max_age(),
+            )
+            response.cache_anonymous = True
+        return response
+    return wrapper
+
+
+class AnonymousPageCacheMiddleware:
+    """
+    Отдаёт сохранённые страницы запросам без сессии раньше, чем
+    работают сессии, CSRF и аутентификация. Ставится в начало
+    MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (request.method not in SAFE_METHODS
+                or settings.SESSION_COOKIE_NAME in request.COOKIES):
+            return self.get_response(request)
+        key = page_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            response, versions = cached
+            if key_versions(list(versions)) == versions:
+                return get_conditional_response(
+                    request, etag=response.get('ETag'), response=response,
+                )
+        generation = get_generation()
+        response = self.get_response(request)
+        # запись во время отрисовки: страница могла устареть
+        if generation != get_generation():
+            return response
+        if getattr(response, 'cache_anonymous', False) and not (
+            response.cookies or response.streaming
+        ):
+            versions = key_versions(response['Surrogate-Key'].split())
+            cache.set(key, (response, versions), PAGE_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,170 @@
+import base64
+import json
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+AFTER = 'n'
+BEFORE = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def keyset_ordering(queryset):
+    """Порядок выдачи ('-pub_date', '-id') по Meta.ordering модели."""
+    field = queryset.model._meta.ordering[0].lstrip('-')
+    return ('-' + field, '-id')
+
+
+def encode_cursor(direction, obj, field):
+    value = getattr(obj, field)
+    payload = json.dumps([direction, value.isoformat(), obj.pk])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value, pk = json.loads(base64.urlsafe_b64decode(padded))
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if direction not in (AFTER, BEFORE) or value is None:
+        raise InvalidCursor(cursor)
+    return direction, value, pk
+
+
+class CursorPage:
+    """Страница выдачи по курсору: без номера и без общего количества."""
+
+    def __init__(self, object_list, paginator, cursor, has_next,
+                 has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.number = None
+
+    def __repr__(self):
+        return '<CursorPage %s>' % (self.cursor or 'first')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.cursor_for(AFTER, self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.cursor_for(BEFORE, self.object_list[0])
+
+
+class CursorPaginator:
+    """
+    Постраничная выдача по ключу (pub_date, id) вместо LIMIT/OFFSET.
+
+    Каждая страница — один запрос на per_page + 1 строк по индексу,
+    COUNT(*) не выполняется, поэтому глубокие страницы стоят
+    столько же, сколько первая.
+    """
+
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = keyset_ordering(object_list)
+        self.field = self.ordering[0].lstrip('-')
+
+    def cursor_for(self, direction, obj):
+        return encode_cursor(direction, obj, self.field)
+
+    def head(self):
+        """Первые per_page + 1 объектов: лишний показывает, есть ли ещё."""
+        return list(
+            self.object_list.order_by(*self.ordering)[:self.per_page + 1]
+        )
+
+    def page(self, cursor=None):
+        if not cursor:
+            items = self.head()
+            return CursorPage(
+                items[:self.per_page], self, cursor,
+                has_next=len(items) > self.per_page,
+                has_previous=False,
+            )
+
+        direction, value, pk = decode_cursor(cursor)
+        field = self.field
+        if direction == AFTER:
+            queryset = self.object_list.filter(
+                Q(**{field + '__lt': value})
+                | Q(**{field: value, 'pk__lt': pk})
+            ).order_by(*self.ordering)
+        else:
+            queryset = self.object_list.filter(
+                Q(**{field + '__gt': value})
+                | Q(**{field: value, 'pk__gt': pk})
+            ).order_by(field, 'id')
+        items = list(queryset[:self.per_page + 1])
+        if not items:
+            return self.page()
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+
+        if direction == AFTER:
+            return CursorPage(
+                items, self, cursor,
+                has_next=has_more, has_previous=True,
+            )
+        items.reverse()
+        return CursorPage(
+            items, self, cursor,
+            has_next=True, has_previous=has_more,
+        )
+
+    def get_page(self, cursor=None):
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+
+def first_page(cursor_paginator):
+    """
+    Первая страница ленты без COUNT(*) и OFFSET: head() курсорной
+    выдачи, обёрнутый в обычные Paginator и Page для шаблонов.
+    Дальше лента листается курсором next_cursor.
+    """
+    paginator = Paginator(cursor_paginator.head(), cursor_paginator.per_page)
+    page = paginator.page(1)
+    page.previous_cursor = None
+    page.next_cursor = None
+    if page.has_next():
+        page.next_cursor = cursor_paginator.cursor_for(
+            AFTER, page[len(page) - 1]
+        )
+    return paginator, page
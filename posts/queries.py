@@ -0,0 +1,44 @@
+from django.db.models import Exists, OuterRef
+
+from . import lookups
+from .models import Follow, Post
+from .paginator import CursorPaginator
+
+FEED_FIELDS = (
+    'text', 'pub_date', 'image', 'comment_count', 'updated',
+    'author', 'author__username',
+    'group', 'group__title', 'group__slug',
+)
+COMMENTS_PER_PAGE = 10
+
+
+def feed_posts(**filters):
+    """
+    Общий запрос для лент: автор и группа одним JOIN, только те
+    колонки, что нужны include/post_item.html. Число комментариев
+    берётся из Post.comment_count, поэтому Count('comments') не нужен.
+    """
+    return Post.objects.select_related(
+        'author', 'group'
+    ).only(*FEED_FIELDS).filter(**filters)
+
+
+def post_detail(author, post_id, user, cursor=None):
+    """
+    Контекст страницы записи за два запроса: запись вместе с автором,
+    его счётчиками, группой и подпиской (подзапрос EXISTS), затем
+    страница комментариев с авторами.
+    """
+    queryset = Post.objects.select_related('author__stats', 'group')
+    if user.is_authenticated:
+        queryset = queryset.annotate(following=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('author'))
+        ))
+    post = lookups.get_post(queryset, author, post_id)
+    comments = post.comments.select_related('author')
+    return {
+        'post': post,
+        'following': getattr(post, 'following', False),
+        'comments': comments,
+        'page': CursorPaginator(comments, COMMENTS_PER_PAGE).get_page(cursor),
+    }
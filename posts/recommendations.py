@@ -0,0 +1,127 @@
+"""
+Рекомендации «на кого подписаться» по графу подписок.
+
+Граф загружается в массивы CSR: id пользователей отсортированы
+в ids, following и followers — пары (indptr, indices), соседи
+вершины i — indices[indptr[i]:indptr[i + 1]]. Вес автора
+для пользователя складывается из двух сигналов:
+- друзья друзей: авторы, на которых подписаны его авторы;
+- соподписчики: авторы, на которых подписаны другие подписчики
+  его авторов (выборка ограничена CO_FOLLOWER_SAMPLE).
+"""
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from . import cache
+from .models import Follow, Recommendation
+
+TOP_N = getattr(settings, 'RECOMMENDATIONS_TOP_N', 20)
+CO_FOLLOWER_SAMPLE = getattr(settings, 'RECOMMENDATIONS_SAMPLE', 20)
+FRIEND_WEIGHT = 2
+BATCH_SIZE = 500
+
+
+def build_csr(rows, cols, size):
+    """Сортировка подсчётом: пары (rows[k], cols[k]) в CSR."""
+    indptr = array('l', [0]) * (size + 1)
+    for row in rows:
+        indptr[row + 1] += 1
+    for i in range(size):
+        indptr[i + 1] += indptr[i]
+    indices = array('l', [0]) * len(rows)
+    fill = array('l', indptr[:-1])
+    for row, col in zip(rows, cols):
+        indices[fill[row]] = col
+        fill[row] += 1
+    return indptr, indices
+
+
+class FollowGraph:
+    def __init__(self, pairs):
+        users, authors = array('l'), array('l')
+        for user_id, author_id in pairs:
+            users.append(user_id)
+            authors.append(author_id)
+        self.ids = array('l', sorted(set(users) | set(authors)))
+        users = array('l', (bisect_left(self.ids, pk) for pk in users))
+        authors = array('l', (bisect_left(self.ids, pk) for pk in authors))
+        self.following = build_csr(users, authors, len(self.ids))
+        self.followers = build_csr(authors, users, len(self.ids))
+
+    @classmethod
+    def load(cls):
+        return cls(
+            Follow.objects.order_by().values_list(
+                'user_id', 'author_id'
+            ).iterator(chunk_size=10000)
+        )
+
+    @staticmethod
+    def neighbours(csr, vertex):
+        indptr, indices = csr
+        return indices[indptr[vertex]:indptr[vertex + 1]]
+
+    def recommend(self, vertex, top_n=TOP_N):
+        """Пары (вес, индекс автора) по убыванию веса; при равном весе
+        раньше идёт меньший индекс."""
+        followed = self.neighbours(self.following, vertex)
+        scores = Counter()
+        for author in followed:
+            scores.update(
+                dict.fromkeys(self.neighbours(self.following, author),
+                              FRIEND_WEIGHT)
+            )
+            co_followers = self.neighbours(self.followers, author)
+            for other in co_followers[:CO_FOLLOWER_SAMPLE]:
+                if other != vertex:
+                    scores.update(self.neighbours(self.following, other))
+        for author in followed:
+            scores.pop(author, None)
+        scores.pop(vertex, None)
+        best = heapq.nlargest(
+            top_n, ((score, -author) for author, score in scores.items())
+        )
+        return [(score, -negative) for score, negative in best]
+
+    def recommendations(self, top_n=TOP_N):
+        for vertex in range(len(self.ids)):
+            for score, author in self.recommend(vertex, top_n):
+                yield Recommendation(
+                    user_id=self.ids[vertex],
+                    author_id=self.ids[author],
+                    score=score,
+                )
+
+
+def compute(top_n=TOP_N):
+    """Пересчитывает таблицу рекомендаций целиком."""
+    graph = FollowGraph.load()
+    rows = graph.recommendations(top_n)
+    count = 0
+    with transaction.atomic():
+        Recommendation.objects.all().delete()
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            Recommendation.objects.bulk_create(batch)
+            count += len(batch)
+    cache.bump_generation()
+    return count
+
+
+def for_user(user, limit=5):
+    """Рекомендации одним запросом; уже начатые подписки отбрасываются."""
+    if not user.is_authenticated:
+        return []
+    return list(
+        Recommendation.objects.filter(user=user).exclude(
+            author__following__user=user
+        ).select_related('author')[:limit]
+    )
@@ -0,0 +1,219 @@
+import re
+
+from django.db import connection
+
+from .models import Post
+
+SQLITE_TABLE = 'posts_post_fts'
+POSTGRES_TABLE = 'posts_post_search'
+POSTGRES_CONFIG = 'russian'
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts5_support = {}
+
+
+def backend(conn=connection):
+    """
+    Полнотекстовый индекс: FTS5 на SQLite, tsvector + GIN на PostgreSQL.
+    Для остальных баз поиск работает через icontains.
+    """
+    if conn.vendor == 'sqlite' and sqlite_has_fts5(conn):
+        return 'sqlite'
+    if conn.vendor == 'postgresql':
+        return 'postgresql'
+    return None
+
+
+def sqlite_has_fts5(conn):
+    if conn.alias not in _fts5_support:
+        with conn.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            options = {row[0] for row in cursor.fetchall()}
+        _fts5_support[conn.alias] = 'ENABLE_FTS5' in options
+    return _fts5_support[conn.alias]
+
+
+def create_index(conn):
+    kind = backend(conn)
+    with conn.cursor() as cursor:
+        if kind == 'sqlite':
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING '
+                f'fts5(text, group_title, '
+                f'tokenize="unicode61 remove_diacritics 2")'
+            )
+        elif kind == 'postgresql':
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ('
+                f'post_id integer PRIMARY KEY '
+                f'REFERENCES posts_post (id) ON DELETE CASCADE '
+                f'DEFERRABLE INITIALLY DEFERRED, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_gin '
+                f'ON {POSTGRES_TABLE} USING GIN (document)'
+            )
+
+
+def drop_index(conn):
+    kind = backend(conn)
+    table = {'sqlite': SQLITE_TABLE, 'postgresql': POSTGRES_TABLE}.get(kind)
+    if table:
+        with conn.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def index_posts(rows, conn=connection):
+    """rows — тройки (id, text, group_title)."""
+    kind = backend(conn)
+    if kind is None:
+        return
+    rows = list(rows)
+    with conn.cursor() as cursor:
+        if kind == 'sqlite':
+            cursor.executemany(
+                f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s',
+                [(pk,) for pk, text, title in rows],
+            )
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, text, group_title) '
+                f'VALUES (%s, %s, %s)',
+                [(pk, text, title or '') for pk, text, title in rows],
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {POSTGRES_TABLE} (post_id, document) '
+                f'VALUES (%s, setweight(to_tsvector(%s, %s), \'A\') || '
+                f'setweight(to_tsvector(%s, %s), \'B\')) '
+                f'ON CONFLICT (post_id) DO UPDATE '
+                f'SET document = EXCLUDED.document',
+                [
+                    (pk, POSTGRES_CONFIG, text,
+                     POSTGRES_CONFIG, title or '')
+                    for pk, text, title in rows
+                ],
+            )
+
+
+def index_post(post):
+    title = post.group.title if post.group_id else ''
+    index_posts([(post.pk, post.text, title)])
+
+
+def remove_posts(post_ids, conn=connection):
+    kind = backend(conn)
+    if kind == 'sqlite':
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in post_ids],
+            )
+    elif kind == 'postgresql':
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {POSTGRES_TABLE} WHERE post_id = ANY(%s)',
+                [list(post_ids)],
+            )
+
+
+def reindex(post_ids=None, batch_size=500):
+    posts = Post.objects.order_by('pk').values_list(
+        'pk', 'text', 'group__title'
+    )
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    batch = []
+    for row in posts.iterator():
+        batch.append(row)
+        if len(batch) >= batch_size:
+            index_posts(batch)
+            batch = []
+    index_posts(batch)
+
+
+def rebuild():
+    drop_index(connection)
+    create_index(connection)
+    reindex()
+
+
+def sqlite_match(query):
+    """Каждое слово запроса — префикс; спецсимволы FTS5 не пропускаются."""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+class SearchResults:
+    """
+    Последовательность записей по убыванию релевантности для Paginator:
+    len() — один COUNT по индексу, срез — одна страница id из индекса
+    и одна выборка записей.
+    """
+
+    def __init__(self, query, queryset):
+        self.query = query
+        self.queryset = queryset
+        self.kind = backend()
+        self._count = None
+
+    def _sql(self, select):
+        if self.kind == 'sqlite':
+            return (
+                f'SELECT {select} FROM {SQLITE_TABLE} '
+                f'WHERE {SQLITE_TABLE} MATCH %s',
+                [sqlite_match(self.query)],
+            )
+        return (
+            f'SELECT {select} FROM {POSTGRES_TABLE}, '
+            f'plainto_tsquery(%s, %s) query WHERE document @@ query',
+            [POSTGRES_CONFIG, self.query],
+        )
+
+    def _fallback(self):
+        return self.queryset.filter(text__icontains=self.query)
+
+    def count(self):
+        if self._count is None:
+            if not WORD_RE.search(self.query):
+                self._count = 0
+            elif self.kind is None:
+                self._count = self._fallback().count()
+            else:
+                sql, params = self._sql('COUNT(*)')
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if not WORD_RE.search(self.query):
+            return []
+        if self.kind is None:
+            return list(self._fallback()[start:stop])
+        if self.kind == 'sqlite':
+            sql, params = self._sql(f'rowid, bm25({SQLITE_TABLE}) AS rank')
+            sql += ' ORDER BY rank'
+        else:
+            sql, params = self._sql(
+                'post_id, ts_rank(document, query) AS rank'
+            )
+            sql += ' ORDER BY rank DESC'
+        sql += ' LIMIT %s OFFSET %s'
+        params += [stop - start, start]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = self.queryset.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def search(query, queryset=None):
+    if queryset is None:
+        queryset = Post.objects.all()
+    return SearchResults(query.strip(), queryset)
@@ -0,0 +1,238 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as default_cache
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import cache, counters, lookups, pagecache, search, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_counter(instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_post_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_post_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_user_counter(instance.author_id, 'followers_count', 1)
+        counters.change_user_counter(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_counter(instance.author_id, 'followers_count', -1)
+    counters.change_user_counter(instance.user_id, 'following_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Follow)
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=User)
+def invalidate_feeds(sender, raw=False, update_fields=None, **kwargs):
+    # до коммита читатель ещё видит старые строки и сохранил бы их
+    # под новым поколением
+    if not raw and not is_login_update(update_fields):
+        transaction.on_commit(cache.bump_generation)
+
+
+def is_login_update(update_fields):
+    return update_fields is not None and set(update_fields) == {'last_login'}
+
+
+# HTML записей в кэше зависит от автора и группы: вместо того чтобы
+# переписывать post.updated у всех их записей, меняется версия
+@receiver([post_save, post_delete], sender=Group)
+def bump_group_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pk = instance.pk
+        transaction.on_commit(lambda: cache.bump_group_version(pk))
+
+
+@receiver([post_save, post_delete], sender=User)
+def bump_author_version(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    if not raw and not is_login_update(update_fields):
+        pk = instance.pk
+        transaction.on_commit(lambda: cache.bump_author_version(pk))
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_posts([instance.pk])
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_title(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance.title_changed = Group.objects.filter(
+            pk=instance.pk
+        ).exclude(title=instance.title).exists()
+
+
+@receiver(post_save, sender=Group)
+def reindex_group_posts(sender, instance, created, raw=False, **kwargs):
+    # в индексе только название группы: остальные правки его не меняют
+    if not (created or raw) and getattr(instance, 'title_changed', False):
+        search.reindex(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_posts(sender, instance, **kwargs):
+    instance.search_post_ids = list(
+        instance.posts.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Group)
+def reindex_ungrouped_posts(sender, instance, **kwargs):
+    search.reindex(getattr(instance, 'search_post_ids', []))
+
+
+@receiver([post_save, post_delete], sender=Post)
+def purge_post_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.purge_on_commit('feed', *pagecache.object_keys(instance))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def purge_comment_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.purge_on_commit(f'post-{instance.post_id}')
+
+
+@receiver([post_save, post_delete], sender=Follow)
+def purge_follow_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.purge_on_commit(
+            f'author-{instance.author_id}', f'author-{instance.user_id}'
+        )
+
+
+@receiver([post_save, post_delete], sender=Group)
+def purge_group_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        pagecache.purge_on_commit(f'group-{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=User)
+def purge_author_pages(sender, instance, raw=False, update_fields=None,
+                       **kwargs):
+    if not raw and not is_login_update(update_fields):
+        pagecache.purge_on_commit(f'author-{instance.pk}')
+
+
+@receiver(pre_save, sender=Group)
+def forget_renamed_group(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        slugs = list(Group.objects.filter(
+            pk=instance.pk
+        ).exclude(slug=instance.slug).values_list('slug', flat=True))
+        if slugs:
+            transaction.on_commit(lambda: lookups.forget_groups(*slugs))
+
+
+# записи поиска сбрасываются после коммита: иначе параллельный запрос
+# заново положит в кэш ещё не изменённую строку
+@receiver([post_save, post_delete], sender=Group)
+def forget_group(sender, instance, raw=False, **kwargs):
+    if not raw:
+        slug = instance.slug
+        transaction.on_commit(lambda: lookups.forget_groups(slug))
+
+
+@receiver(pre_save, sender=User)
+def forget_renamed_user(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    if not (raw or instance.pk is None or is_login_update(update_fields)):
+        names = instance.old_usernames = list(User.objects.filter(
+            pk=instance.pk
+        ).exclude(username=instance.username).values_list(
+            'username', flat=True
+        ))
+        if names:
+            transaction.on_commit(lambda: lookups.forget_users(*names))
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and not is_login_update(update_fields):
+        username = instance.username
+        transaction.on_commit(lambda: lookups.forget_users(username))
+
+
+@receiver(post_save, sender=User)
+def remember_username(sender, instance, created, raw=False,
+                      update_fields=None, **kwargs):
+    if raw or is_login_update(update_fields):
+        return
+    if created or getattr(instance, 'old_usernames', None):
+        lookups.usernames.add(instance.username)
+
+
+@receiver(post_save, sender=Post)
+def forget_missing_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        author_id, pk = instance.author_id, instance.pk
+        transaction.on_commit(
+            lambda: lookups.forget_missing_post(author_id, pk)
+        )
+
+
+@receiver(post_migrate)
+def clear_caches(sender, **kwargs):
+    """migrate и flush меняют данные в обход сигналов моделей."""
+    if sender.name == 'posts':
+        default_cache.clear()
+        lookups.usernames.reset()
@@ -0,0 +1,15 @@
+from django import template
+
+from posts.cache import render_post_items
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def render_posts(context, posts):
+    return render_post_items(posts, context.get('user'))
+
+
+@register.simple_tag(takes_context=True)
+def render_post(context, post):
+    return render_post_items([post], context.get('user'))
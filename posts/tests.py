@@ -1,17 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
+from PIL import Image
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
-from django.test import Client, TestCase
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
 from django.urls import reverse
 
-from .models import Comment, Follow, Group, Post
+from yatube import metrics, sqlite, timing
+from yatube.cache import TieredCache
+
+from . import (follows, lookups, pagecache, recommendations, search,
+               thumbnails, timeline)
+from .cache import get_generation
+from .forms import PostForm
+from .models import (AuthorStats, Comment, Follow, Group, Post, Recommendation,
+                     TimelineEntry)
+from .queries import post_detail
 
 User = get_user_model()
 
 
 class HelperTest():
     def setInit(self):
+        # записи тестов не коммитятся, и поколение лент с версиями
+        # страниц не меняется: кэш прошлого теста не должен отдаваться
+        cache.clear()
         self.client = Client()
         self.client2 = Client()
         self.user_jerry = User.objects.create_user(
@@ -41,6 +70,19 @@ class HelperTest():
         self.text_post = 'Lets go!'
         self.text_post_upd = 'Atack! I say, atack!'
 
+    @contextmanager
+    def committed(self):
+        """
+        TestCase не коммитит: on_commit из блока выполняются при выходе
+        из него, как captureOnCommitCallbacks в Django 3.2.
+        """
+        start = len(connection.run_on_commit)
+        yield
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for sids, func in callbacks:
+            func()
+
     def create_post(self, image=None):
         return Post.objects.create(
             text=self.text_post,
@@ -133,14 +175,32 @@ class TestPosts(TestCase, HelperTest):
         self.assert_responses(responses, self.text_post, self.group_cats)
 
     def test_cache_index(self):
-        response_1 = self.client.get(reverse('index'))
         post = self.create_post()
+        response_1 = self.client.get(reverse('index'))
+        Post.objects.filter(pk=post.pk).update(text=self.text_post_upd)
         response_2 = self.client.get(reverse('index'))
         self.assertEqual(response_1.content, response_2.content)
         cache.clear()
         response_3 = self.client.get(reverse('index'))
         self.assertNotEqual(response_1.content, response_3.content)
-        self.assertEqual(response_3.context['page'][0].text, self.text_post)
+        self.assertContains(response_3, self.text_post_upd)
+
+    def test_cache_index_invalidated_on_write(self):
+        response_1 = self.client.get(reverse('index'))
+        with self.committed():
+            self.create_post()
+        response_2 = self.client.get(reverse('index'))
+        self.assertNotEqual(response_1.content, response_2.content)
+        self.assertContains(response_2, self.text_post)
+
+    def test_cache_follow_per_user(self):
+        self.client2.force_login(self.user_tom)
+        self.create_post()
+        Follow.objects.create(user=self.user_jerry, author=self.user_jerry)
+        response = self.client.get(reverse('follow_index'))
+        self.assertContains(response, self.text_post)
+        response = self.client2.get(reverse('follow_index'))
+        self.assertNotContains(response, self.text_post)
 
 
 class TestComments(TestCase, HelperTest):
@@ -178,6 +238,100 @@ class TestComments(TestCase, HelperTest):
         self.assertEqual(post_template.text, self.text)
 
 
+class TestLazyComments(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        self.args = (self.user_jerry, self.post.pk)
+
+    def add_comments(self, count):
+        for number in range(count):
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text=f'Comment {number}'
+            )
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post', args=self.args))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_post_page_constant_queries(self):
+        self.add_comments(2)
+        small, response = self.count_queries()
+        self.assertFalse(response.context['form'].is_bound)
+        self.add_comments(30)
+        large, response = self.count_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['page']), 10)
+        self.assertContains(response, 'comments-more')
+
+    def test_comments_json_pages(self):
+        self.add_comments(25)
+        url = reverse('post_comments', args=self.args)
+        texts, cursor = [], ''
+        lookups.get_user(self.user_jerry.username)
+        for _ in range(3):
+            with self.assertNumQueries(2):
+                data = self.client2.get(url, {'cursor': cursor}).json()
+            texts += [comment['text'] for comment in data['comments']]
+            self.assertIn(data['comments'][0]['text'], data['html'])
+            self.assertEqual(data['comments'][0]['author'], 'tom')
+            cursor = data['next_cursor']
+        self.assertIsNone(cursor)
+        self.assertEqual(
+            texts, [f'Comment {number}' for number in range(24, -1, -1)]
+        )
+
+    def test_comments_json_errors(self):
+        url = reverse('post_comments', args=self.args)
+        self.assertEqual(
+            self.client2.get(url, {'cursor': 'broken'}).status_code, 400
+        )
+        url = reverse('post_comments', args=(self.user_tom, self.post.pk))
+        self.assertEqual(self.client2.get(url).status_code, 404)
+
+
+class TestPostDetail(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        for number in range(3):
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text=f'Comment {number}'
+            )
+        self.client2.force_login(self.user_tom)
+        self.url = reverse('post', args=(self.user_jerry, self.post.pk))
+
+    def test_loader_queries(self):
+        with self.assertNumQueries(2):
+            context = post_detail(self.user_jerry, self.post.pk, self.user_tom)
+            self.assertEqual(context['post'].author.stats.posts_count, 1)
+            self.assertEqual(context['post'].group, self.group_cats)
+            self.assertEqual(
+                [comment.author.username for comment in context['page']],
+                ['tom'] * 3,
+            )
+        self.assertFalse(context['following'])
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        context = post_detail(self.user_jerry, self.post.pk, self.user_tom)
+        self.assertTrue(context['following'])
+        context = post_detail(
+            self.user_jerry, self.post.pk, AnonymousUser()
+        )
+        self.assertFalse(context['following'])
+
+    def test_view_queries(self):
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        lookups.get_user('jerry')
+        # сессия и пользователь, затем запись и комментарии
+        with self.assertNumQueries(4):
+            response = self.client2.get(self.url)
+        self.assertTrue(response.context['following'])
+        self.assertContains(response, 'Comment 2')
+
+
 class TestImages(TestCase, HelperTest):
     def setUp(self):
         self.setInit()
@@ -225,10 +379,68 @@ class TestImages(TestCase, HelperTest):
         self.assertFormError(post, 'form', 'image', error_text)
         self.assertFalse(Post.objects.all().exists())
 
+    @mock.patch('posts.views.thumbnails.schedule')
+    @mock.patch(
+        'posts.views.transaction.on_commit', side_effect=lambda func: func()
+    )
+    def test_img_thumbnails_scheduled(self, on_commit, schedule):
+        self.client.post(
+            reverse('new_post'),
+            {'text': 'post with image', 'image': self.uploaded}
+        )
+        post = Post.objects.get()
+        schedule.assert_called_once_with(post.image.name)
+
+    @mock.patch('posts.thumbnails.generate')
+    def test_thumbnail_workers(self, generate):
+        thumbnails.schedule('posts/small.gif')
+        thumbnails.get_executor().shutdown(wait=True)
+        thumbnails._executor = None
+        generate.assert_called_once_with('posts/small.gif')
+        self.assertEqual(thumbnails.queue_depth(), 0)
+
     def tearDown(self):
         Post.objects.all().delete()
 
 
+class TestImageUpload(TestCase):
+    def get_upload(self, mode='RGB', size=(3000, 100), fmt='JPEG', **kwargs):
+        buffer = BytesIO()
+        Image.new(mode, size, color='red').save(buffer, fmt, **kwargs)
+        return SimpleUploadedFile(
+            f'photo.{fmt.lower()}', buffer.getvalue(),
+            content_type=f'image/{fmt.lower()}'
+        )
+
+    def get_form(self, upload):
+        return PostForm({'text': 'text'}, files={'image': upload})
+
+    def test_resized_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Phone'
+        form = self.get_form(self.get_upload(exif=exif.tobytes()))
+        self.assertTrue(form.is_valid(), form.errors)
+        image_file = form.cleaned_data['image']
+        self.assertEqual(image_file.name, 'photo.jpg')
+        image = Image.open(image_file)
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (1920, 64))
+        self.assertNotIn('exif', image.info)
+
+    def test_transparent_to_webp(self):
+        form = self.get_form(
+            self.get_upload(mode='RGBA', size=(50, 50), fmt='PNG')
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['image'].name, 'photo.webp')
+
+    @mock.patch('posts.images.MAX_UPLOAD_PIXELS', 1000)
+    def test_too_many_pixels(self):
+        form = self.get_form(self.get_upload())
+        self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+
 class TestFollows(TestCase, HelperTest):
     def setUp(self):
         self.setInit()
@@ -269,6 +481,1404 @@ class TestFollows(TestCase, HelperTest):
         self.assertEqual(posts_count, 0)
 
 
+class TestCursorPagination(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        cache.clear()
+        for i in range(25):
+            Post.objects.create(text=f'Post {i}', author=self.user_jerry)
+
+    def get_texts(self, response):
+        return [post.text for post in response.context['page']]
+
+    def test_cursor_walks_all_posts(self):
+        response = self.client2.get(reverse('index'))
+        texts = self.get_texts(response)
+        cursor = response.context['page'].next_cursor
+        while cursor:
+            response = self.client2.get(reverse('index'), {'cursor': cursor})
+            texts += self.get_texts(response)
+            cursor = response.context['page'].next_cursor
+        self.assertEqual(texts, [f'Post {i}' for i in range(24, -1, -1)])
+
+    def test_cursor_previous_page(self):
+        first = self.client2.get(reverse('index'))
+        second = self.client2.get(
+            reverse('index'), {'cursor': first.context['page'].next_cursor}
+        )
+        back = self.client2.get(
+            reverse('index'),
+            {'cursor': second.context['page'].previous_cursor}
+        )
+        self.assertEqual(self.get_texts(back), self.get_texts(first))
+        self.assertFalse(back.context['page'].has_previous())
+
+    def test_first_page_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client2.get(reverse('index'), {'page': 3})
+        self.assertEqual(self.get_texts(response)[0], 'Post 24')
+        self.assertTrue(response.context['page'].next_cursor)
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('COUNT(', query['sql'])
+
+    def test_cursor_page_without_count(self):
+        first = self.client2.get(reverse('index'))
+        cursor = first.context['page'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client2.get(reverse('index'), {'cursor': cursor})
+        self.assertEqual(len(response.context['page']), 10)
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertFalse(
+                query['sql'].startswith('SELECT COUNT(*)'), query['sql']
+            )
+
+    def test_invalid_cursor(self):
+        response = self.client2.get(reverse('index'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_texts(response)[0], 'Post 24')
+
+
+class TestCounters(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.client2.force_login(self.user_tom)
+
+    def get_stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_post_and_comment_counters(self):
+        self.client.post(reverse('new_post'), {'text': self.text_post})
+        post = Post.objects.get()
+        self.assertEqual(self.get_stats(self.user_jerry).posts_count, 1)
+        self.client2.post(
+            reverse('add_comment', args=(self.user_jerry, post.pk)),
+            {'text': 'Comment'}
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        post.comments.all().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_follow_counters(self):
+        url = reverse('profile_follow', args=(self.user_jerry,))
+        self.client2.get(url)
+        self.client2.get(url)
+        self.assertEqual(self.get_stats(self.user_jerry).followers_count, 1)
+        self.assertEqual(self.get_stats(self.user_tom).following_count, 1)
+        self.client2.get(reverse('profile_unfollow', args=(self.user_jerry,)))
+        self.assertEqual(self.get_stats(self.user_jerry).followers_count, 0)
+        self.assertEqual(self.get_stats(self.user_tom).following_count, 0)
+
+    def test_recount_command(self):
+        post = self.create_post()
+        Comment.objects.create(text='1', author=self.user_tom, post=post)
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        Post.objects.update(comment_count=7)
+        AuthorStats.objects.all().delete()
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        stats = self.get_stats(self.user_jerry)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(self.get_stats(self.user_tom).following_count, 1)
+
+    def test_feed_without_aggregates(self):
+        for _ in range(10):
+            self.create_post()
+        with CaptureQueriesContext(connection) as queries:
+            Client().get(reverse('profile', args=(self.user_jerry,)))
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([q for q in sql if '"posts_comment"' in q])
+        self.assertFalse([q for q in sql if '"posts_follow"' in q])
+        self.assertFalse([q for q in sql if 'COUNT(' in q])
+
+
+class TestTimeline(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.client2.force_login(self.user_tom)
+        self.post = self.create_post()
+
+    def get_feed(self):
+        response = self.client2.get(reverse('follow_index'))
+        return [post.pk for post in response.context['page']]
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        self.client2.get(reverse('profile_follow', args=(self.user_jerry,)))
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.user_tom, post=self.post
+            ).exists()
+        )
+        self.assertEqual(self.get_feed(), [self.post.pk])
+        self.client2.get(
+            reverse('profile_unfollow', args=(self.user_jerry,))
+        )
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [])
+
+    def test_new_post_fans_out(self):
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        self.client.post(reverse('new_post'), {'text': self.text_post_upd})
+        new_post = Post.objects.get(text=self.text_post_upd)
+        self.assertEqual(self.get_feed(), [new_post.pk, self.post.pk])
+
+    def test_celebrity_read_on_request(self):
+        AuthorStats.objects.filter(user=self.user_jerry).update(
+            followers_count=timeline.FANOUT_LIMIT + 1
+        )
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        new_post = self.create_post()
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [new_post.pk, self.post.pk])
+
+    def test_rebuild_command(self):
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(self.get_feed(), [self.post.pk])
+
+    def test_rebuild_set_based(self):
+        celebrity = User.objects.create_user(username='celebrity')
+        AuthorStats.objects.filter(user=celebrity).update(
+            followers_count=timeline.FANOUT_LIMIT + 1
+        )
+        Post.objects.create(text='Famous', author=celebrity)
+        posts = [self.create_post() for _ in range(3)]
+        for user in (self.user_tom, self.user_jerry):
+            Follow.objects.create(user=user, author=self.user_jerry)
+            Follow.objects.create(user=user, author=celebrity)
+        TimelineEntry.objects.all().delete()
+        with mock.patch.object(timeline, 'BACKFILL_LIMIT', 2), \
+                CaptureQueriesContext(connection) as queries:
+            timeline.rebuild()
+        self.assertEqual(len(queries), 5)
+        for user in (self.user_tom, self.user_jerry):
+            self.assertEqual(
+                list(TimelineEntry.objects.filter(
+                    user=user
+                ).values_list('post_id', flat=True)),
+                [posts[2].pk, posts[1].pk],
+            )
+        self.assertTrue(AuthorStats.objects.get(user=celebrity).timeline_gaps)
+
+    def test_former_celebrity_read_until_rebuild(self):
+        stats = AuthorStats.objects.filter(user=self.user_jerry)
+        stats.update(followers_count=timeline.FANOUT_LIMIT + 1)
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        self.assertTrue(stats.get().timeline_gaps)
+        stats.update(followers_count=1)
+        new_post = self.create_post()
+        self.assertEqual(self.get_feed(), [new_post.pk, self.post.pk])
+        timeline.rebuild()
+        self.assertFalse(stats.get().timeline_gaps)
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+        self.assertEqual(self.get_feed(), [new_post.pk, self.post.pk])
+
+    def test_cursor_pages(self):
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        posts = [self.create_post() for _ in range(11)]
+        response = self.client2.get(reverse('follow_index'))
+        self.assertEqual(len(response.context['page']), 10)
+        cursor = response.context['page'].next_cursor
+        response = self.client2.get(
+            reverse('follow_index'), {'cursor': cursor}
+        )
+        self.assertEqual(
+            [post.pk for post in response.context['page']],
+            [posts[0].pk, self.post.pk],
+        )
+        response = self.client2.get(reverse('follow_index'), {
+            'cursor': response.context['page'].previous_cursor,
+        })
+        self.assertEqual(
+            [post.pk for post in response.context['page']],
+            [post.pk for post in reversed(posts[1:])],
+        )
+
+
+class TestPostItemCache(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        self.group_url = reverse('group', args=(self.group_cats.slug,))
+
+    def test_post_item_cached(self):
+        self.client.get(self.group_url)
+        Post.objects.filter(pk=self.post.pk).update(text=self.text_post_upd)
+        response = self.client.get(self.group_url)
+        self.assertContains(response, self.text_post)
+
+    def test_post_item_invalidated_on_edit(self):
+        self.client.get(self.group_url)
+        self.client.post(
+            reverse('post_edit', args=(self.user_jerry, self.post.pk)),
+            {'text': self.text_post_upd, 'group': self.group_cats.pk}
+        )
+        response = self.client.get(self.group_url)
+        self.assertContains(response, self.text_post_upd)
+
+    def test_post_item_invalidated_on_comment(self):
+        self.client.get(self.group_url)
+        self.client.post(
+            reverse('add_comment', args=(self.user_jerry, self.post.pk)),
+            {'text': 'Comment'}
+        )
+        response = self.client.get(self.group_url)
+        self.assertContains(response, '1 комментарий')
+
+    def test_post_item_invalidated_on_group_change(self):
+        self.client.get(reverse('profile', args=(self.user_jerry,)))
+        self.group_cats.title = 'Big cats'
+        with self.committed():
+            self.group_cats.save()
+        response = self.client.get(reverse('profile', args=(self.user_jerry,)))
+        self.assertContains(response, '#Big cats')
+
+    def test_post_item_invalidated_on_author_change(self):
+        self.client.get(self.group_url)
+        self.user_jerry.username = 'jerome'
+        with self.committed():
+            self.user_jerry.save()
+        response = self.client.get(self.group_url)
+        self.assertContains(response, '@jerome')
+
+    def test_group_change_keeps_posts(self):
+        updated = self.post.updated
+        self.group_cats.description = 'Cats only'
+        with CaptureQueriesContext(connection) as queries:
+            self.group_cats.save()
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('posts_post', sql)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.updated, updated)
+
+    def test_post_item_varies_by_author(self):
+        response = self.client.get(self.group_url)
+        self.assertContains(response, 'Редактировать')
+        response = self.client2.get(self.group_url)
+        self.assertNotContains(response, 'Редактировать')
+
+
+class TestFeedQueries(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        self.client2.force_login(self.user_tom)
+        # фильтр username строится при запуске процесса, как в wsgi.py
+        lookups.usernames.rebuild()
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client2.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feeds_constant_queries(self):
+        urls = {
+            reverse('index'): 3,
+            reverse('group', args=(self.group_cats.slug,)): 4,
+            reverse('profile', args=(self.user_jerry,)): 7,
+            reverse('follow_index'): 6,
+        }
+        self.create_post()
+        for url, budget in urls.items():
+            with self.subTest(url=url):
+                self.assertLessEqual(self.count_queries(url), budget)
+        small = {url: self.count_queries(url) for url in urls}
+        for _ in range(15):
+            self.create_post()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
+
+    def test_feed_columns_pruned(self):
+        self.create_post()
+        with CaptureQueriesContext(connection) as queries:
+            self.client2.get(reverse('index'))
+        sql = ' '.join(
+            query['sql'] for query in queries.captured_queries
+            if 'FROM "posts_post"' in query['sql']
+        )
+        self.assertIn('"posts_group"."title"', sql)
+        self.assertNotIn('"posts_group"."description"', sql)
+        self.assertNotIn('"auth_user"."email"', sql)
+
+
+class TestSearch(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def found(self, query):
+        return [post.pk for post in self.search(query).context['page']]
+
+    def test_search_index_available(self):
+        self.assertIsNotNone(search.backend())
+
+    def test_search_by_text_and_group(self):
+        post = self.create_post()
+        Post.objects.create(text='Something else', author=self.user_tom)
+        self.assertEqual(self.found('lets'), [post.pk])
+        self.assertEqual(self.found('cat'), [post.pk])
+        self.assertEqual(self.found('mice'), [])
+        self.assertEqual(self.found('  '), [])
+
+    def test_search_ranking(self):
+        rare = Post.objects.create(
+            text='Tom chases someone around the house all day long',
+            author=self.user_jerry,
+        )
+        often = Post.objects.create(
+            text='Tom, Tom and Tom', author=self.user_jerry
+        )
+        self.assertEqual(self.found('tom'), [often.pk, rare.pk])
+
+    def test_search_follows_changes(self):
+        post = self.create_post()
+        post.text = self.text_post_upd
+        post.save()
+        self.assertEqual(self.found('lets'), [])
+        self.assertEqual(self.found('atack'), [post.pk])
+        self.group_cats.title = 'Kittens'
+        self.group_cats.save()
+        self.assertEqual(self.found('kittens'), [post.pk])
+        self.group_cats.delete()
+        self.assertEqual(self.found('kittens'), [])
+        post.delete()
+        self.assertEqual(self.found('atack'), [])
+
+    def test_search_pagination_keeps_query(self):
+        for _ in range(12):
+            self.create_post()
+        response = self.search('lets')
+        self.assertEqual(response.context['paginator'].count, 12)
+        self.assertContains(response, '?q=lets&amp;page=2')
+        response = self.search('lets', page=2)
+        self.assertEqual(len(response.context['page']), 2)
+
+    def test_rebuild_search_index(self):
+        post = self.create_post()
+        search.remove_posts([post.pk])
+        self.assertEqual(self.found('lets'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('lets'), [post.pk])
+
+
+class TestQueryPlans(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        self.client2.force_login(self.user_tom)
+        post = self.create_post()
+        Comment.objects.create(post=post, author=self.user_tom, text='Meow')
+        self.post = post
+
+    def plans(self, url, table):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client2.get(url)
+        selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT')
+            and f'FROM "{table}"' in query['sql']
+            and 'COUNT(' not in query['sql']
+        ]
+        self.assertTrue(selects)
+        with connection.cursor() as cursor:
+            for sql in selects:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                yield sql, ' '.join(
+                    str(row[-1]) for row in cursor.fetchall()
+                )
+
+    def assert_plans(self, pages):
+        for url, table in pages:
+            for sql, plan in self.plans(url, table):
+                with self.subTest(url=url, sql=sql):
+                    # записи страницы ленты подписок загружаются по id
+                    self.assertRegex(plan, 'INDEX|PRIMARY KEY')
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_views_use_indexes_without_sorting(self):
+        self.assert_plans([
+            (reverse('index'), 'posts_post'),
+            (reverse('group', args=(self.group_cats.slug,)), 'posts_post'),
+            (reverse('profile', args=(self.user_jerry,)), 'posts_post'),
+            (reverse('post', args=(self.user_jerry, self.post.pk)),
+             'posts_comment'),
+            (reverse('follow_index'), 'posts_timelineentry'),
+            (reverse('follow_index'), 'posts_post'),
+        ])
+
+    def test_read_time_authors_use_indexes(self):
+        AuthorStats.objects.filter(user=self.user_jerry).update(
+            timeline_gaps=True
+        )
+        self.assert_plans([
+            (reverse('follow_index'), 'posts_timelineentry'),
+            (reverse('follow_index'), 'posts_post'),
+        ])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class TestReplicaRouting(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        patcher = mock.patch(
+            'yatube.routers.random.choice', return_value='default'
+        )
+        self.choice = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_feeds_read_from_replica(self):
+        urls = (
+            reverse('index'),
+            reverse('group', args=(self.group_cats.slug,)),
+            reverse('profile', args=(self.user_jerry,)),
+            reverse('post', args=(self.user_jerry, self.post.pk)),
+            reverse('follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.choice.reset_mock()
+                self.client.get(url)
+                self.choice.assert_called_with(['replica1'])
+
+    def test_other_views_read_from_primary(self):
+        self.client.get(reverse('new_post'))
+        self.client.get(
+            reverse('post_edit', args=(self.user_jerry, self.post.pk))
+        )
+        self.client.post(reverse('new_post'), {'text': self.text_post_upd})
+        self.choice.assert_not_called()
+
+    def test_primary_is_sticky_after_write(self):
+        response = self.client.post(
+            reverse('add_comment', args=(self.user_jerry, self.post.pk)),
+            {'text': 'Meow'},
+        )
+        self.assertIn('use_primary', response.cookies)
+        response = self.client.get(
+            reverse('post', args=(self.user_jerry, self.post.pk))
+        )
+        self.assertContains(response, 'Meow')
+        self.choice.assert_not_called()
+
+    def test_primary_is_sticky_after_follow_link(self):
+        response = self.client.get(
+            reverse('profile_follow', args=(self.user_tom,))
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('use_primary', response.cookies)
+        response = self.client.get(response.url)
+        self.assertTrue(response.context['following'])
+        self.choice.assert_not_called()
+
+    def test_reads_do_not_stick_to_primary(self):
+        response = self.client.get(reverse('profile', args=(self.user_tom,)))
+        self.assertNotIn('use_primary', response.cookies)
+
+
+class TestTieredCache(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        params = {'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 3,
+            'INVALIDATION_INTERVAL': 0,
+        }}
+        # два «процесса» с собственными LRU и общим кэшем
+        self.first = TieredCache('tiered-first', params)
+        self.second = TieredCache('tiered-second', params)
+        self.addCleanup(self.first.local.clear)
+        self.addCleanup(self.second.local.clear)
+
+    def test_local_tier_serves_repeated_reads(self):
+        self.first.set('key', 'value')
+        with mock.patch.object(
+            caches['shared'], 'get', wraps=caches['shared'].get
+        ) as shared_get:
+            self.assertEqual(self.first.get('key'), 'value')
+            self.assertEqual(self.first.get('missing', 'default'), 'default')
+        self.assertEqual(
+            [call.args[0] for call in shared_get.call_args_list],
+            ['tiered:epoch', 'tiered:epoch', 'missing'],
+        )
+
+    def test_get_many_batches_misses(self):
+        self.first.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.second.set('d', 4)
+        with mock.patch.object(
+            caches['shared'], 'get_many', wraps=caches['shared'].get_many
+        ) as shared_get_many:
+            self.assertEqual(
+                self.second.get_many(['a', 'b', 'c', 'd', 'e']),
+                {'a': 1, 'b': 2, 'c': 3, 'd': 4},
+            )
+        keys = [call.args[0] for call in shared_get_many.call_args_list]
+        self.assertEqual(keys[-1], ['a', 'b', 'c', 'e'])
+
+    def test_invalidation_reaches_other_processes(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.set('counter', 1)
+        self.assertEqual(self.second.get('counter'), 1)
+        self.first.incr('counter')
+        self.assertEqual(self.second.get('counter'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_counters_bypass_local_tier(self):
+        params = {'OPTIONS': {'SHARED': 'shared', 'INVALIDATION_INTERVAL': 60}}
+        first = TieredCache('tiered-slow-first', params)
+        second = TieredCache('tiered-slow-second', params)
+        self.addCleanup(first.local.clear)
+        self.addCleanup(second.local.clear)
+        first.set('feed:generation', 1)
+        first.add('surrogate:post-1', 5)
+        self.assertEqual(second.get('feed:generation'), 1)
+        self.assertEqual(second.get_many(['surrogate:post-1']),
+                         {'surrogate:post-1': 5})
+        first.incr('feed:generation')
+        first.incr('surrogate:post-1')
+        self.assertEqual(second.get('feed:generation'), 2)
+        self.assertEqual(second.get_many(['surrogate:post-1']),
+                         {'surrogate:post-1': 6})
+        # обычные ключи по-прежнему читаются из LRU до синхронизации
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.set('key', 'new')
+        self.assertEqual(second.get('key'), 'old')
+
+    def test_lost_messages_clear_local_tier(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        caches['shared'].set('key', 'new')
+        caches['shared'].incr('tiered:epoch', 5)
+        self.assertEqual(self.second.get('key'), 'new')
+
+    def test_local_tier_is_bounded(self):
+        for number in range(5):
+            self.first.set(f'key{number}', number)
+        self.assertEqual(len(self.first.local.data), 3)
+        self.assertNotIn(self.first.make_key('key0'), self.first.local.data)
+
+
+class TestRequestTiming(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.create_post()
+        cache.clear()
+
+    @staticmethod
+    def parse(header):
+        metrics = {}
+        for item in header.split(', '):
+            name, *params = item.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('yatube.timing', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('index'))
+        metrics = self.parse(response['Server-Timing'])
+        self.assertEqual(
+            metrics['sql']['desc'], f'"{len(queries)} queries"'
+        )
+        self.assertGreater(float(metrics['template']['dur']), 0)
+        self.assertIn('total', metrics)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['url_name'], 'index')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['sql_count'], len(queries))
+        self.assertGreater(record['cache_misses'], 0)
+
+    def test_cached_page_keeps_url_name(self):
+        url = reverse('group', args=(self.group_cats.slug,))
+        self.client2.get(url)
+        with self.assertLogs('yatube.timing', 'INFO') as logs:
+            self.client2.get(url)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['url_name'], 'group')
+        self.assertEqual(record['sql_count'], 0)
+        self.assertGreater(record['cache_hits'], 0)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_nested_timers_counted_once(self):
+        durations = {}
+
+        def view(request):
+            clock = mock.patch(
+                'yatube.timing.time.perf_counter', side_effect=[1.0, 3.5]
+            )
+            with clock, timing.timer('thumbnail'):
+                with timing.timer('thumbnail'):
+                    pass
+            durations.update(timing.current().durations)
+            return HttpResponse()
+
+        middleware = timing.RequestTimingMiddleware(view)
+        response = middleware(RequestFactory().get('/'))
+        self.assertEqual(durations['thumbnail'], 2.5)
+        self.assertIn('thumbnail;dur=2500.0', response['Server-Timing'])
+        self.assertIsNone(timing.current())
+
+
+@override_settings(METRICS_TOKEN='secret')
+class TestMetrics(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.create_post()
+        cache.clear()
+
+    def scrape(self):
+        response = self.client2.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    @staticmethod
+    def value(text, sample):
+        for line in text.splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.split()[-1])
+        return 0
+
+    def test_request_histograms(self):
+        count = 'yatube_request_duration_seconds_count{view="index"}'
+        queries = 'yatube_request_queries_bucket{view="index",le="+Inf"}'
+        before = self.scrape()
+        self.client2.get(reverse('index'))
+        self.client2.get(reverse('index'))
+        after = self.scrape()
+        self.assertEqual(
+            self.value(after, count) - self.value(before, count), 2
+        )
+        self.assertEqual(
+            self.value(after, queries) - self.value(before, queries), 2
+        )
+        self.assertIn(
+            '# TYPE yatube_request_duration_seconds histogram', after
+        )
+        self.client2.get('/about-spec/')
+        self.assertIn('view="other"', self.scrape())
+
+    def test_fragment_cache_counters(self):
+        hit = 'yatube_fragment_cache_total{fragment="index_page",result="hit"}'
+        miss = (
+            'yatube_fragment_cache_total{fragment="index_page",result="miss"}'
+        )
+        before = self.scrape()
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        after = self.scrape()
+        self.assertEqual(self.value(after, miss) - self.value(before, miss), 1)
+        self.assertEqual(self.value(after, hit) - self.value(before, hit), 1)
+
+    def test_gauges(self):
+        with mock.patch.object(thumbnails, 'queue_depth', return_value=3):
+            text = self.scrape()
+        self.assertEqual(self.value(text, 'yatube_thumbnail_queue_depth'), 3)
+        self.assertIn('yatube_db_connections{alias="default"}', text)
+
+    def test_processes_summed(self):
+        count = 'yatube_request_duration_seconds_count{view="archive"}'
+        depth = 'yatube_thumbnail_queue_depth'
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = [['view', 'archive']]
+        buckets = [0] * len(metrics.DURATION_BUCKETS) + [1.5, 5]
+        for pid, queued in ((os.getppid(), 2), (2 ** 22 + 1, 7)):
+            name = f'{pid}-{uuid.uuid4().hex}.json'
+            with open(os.path.join(directory, name), 'w') as f:
+                json.dump({
+                    'pid': pid,
+                    'counters': [],
+                    'histograms': [
+                        ['yatube_request_duration_seconds', labels, buckets]
+                    ],
+                    'gauges': [[depth, [], queued]],
+                }, f)
+        with override_settings(METRICS_DIR=directory), mock.patch.object(
+            thumbnails, 'queue_depth', return_value=1
+        ):
+            before = self.value(self.scrape(), count)
+            text = self.scrape()
+        self.assertEqual(self.value(text, count), 10)
+        self.assertEqual(before, 10)
+        # очередь завершившегося процесса не учитывается
+        self.assertEqual(self.value(text, depth), 3)
+        files = os.listdir(directory)
+        self.assertIn(metrics.process_file(), files)
+        self.assertIn(metrics.AGGREGATE_FILE, files)
+        self.assertFalse([name for name in files if name.startswith(
+            f'{2 ** 22 + 1}-'
+        )])
+
+    def test_process_file_unique(self):
+        name = metrics.process_file()
+        self.assertTrue(name.startswith(f'{os.getpid()}-'))
+        metrics.start_process()
+        self.assertNotEqual(metrics.process_file(), name)
+
+    def test_forbidden_for_other_hosts(self):
+        response = self.client2.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        response = self.client2.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer wrong'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_closed_unless_configured(self):
+        self.assertEqual(self.client2.get('/metrics').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.5']):
+            response = self.client2.get('/metrics', REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+
+
+class TestSqliteProfile(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    @mock.patch.object(sqlite, 'RETRY_DELAY', 0)
+    def test_write_retried_when_locked(self):
+        view = mock.Mock(side_effect=[
+            OperationalError('database is locked'),
+            OperationalError('database is locked'),
+            'response',
+        ])
+        self.assertEqual(sqlite.retry_on_locked(view)('request'), 'response')
+        self.assertEqual(view.call_count, 3)
+
+        view = mock.Mock(side_effect=OperationalError('database is locked'))
+        with self.assertRaises(OperationalError):
+            sqlite.retry_on_locked(view)('request')
+        self.assertEqual(view.call_count, sqlite.RETRY_ATTEMPTS)
+
+        view = mock.Mock(side_effect=OperationalError('no such table'))
+        with self.assertRaises(OperationalError):
+            sqlite.retry_on_locked(view)('request')
+        self.assertEqual(view.call_count, 1)
+
+
+class TestWriteTransactions(TestCase, HelperTest):
+    """С BEGIN IMMEDIATE транзакция берёт блокировку записи SQLite."""
+
+    def setUp(self):
+        self.setInit()
+        self.client2.force_login(self.user_tom)
+        self.post = self.create_post()
+
+    def test_reads_do_not_open_transaction(self):
+        urls = [
+            reverse('new_post'),
+            reverse('add_comment', args=(self.user_jerry, self.post.pk)),
+            reverse('post_edit', args=(self.user_jerry, self.post.pk)),
+        ]
+        for url in urls:
+            with self.subTest(url=url), mock.patch(
+                'posts.views.transaction', wraps=transaction
+            ) as views_transaction:
+                self.client.get(url)
+                views_transaction.atomic.assert_not_called()
+
+    def test_writes_open_transaction(self):
+        with mock.patch(
+            'posts.views.transaction', wraps=transaction
+        ) as views_transaction:
+            self.client.post(reverse('new_post'), {'text': self.text_post})
+            self.client2.get(
+                reverse('profile_follow', args=(self.user_jerry,))
+            )
+        self.assertEqual(views_transaction.atomic.call_count, 2)
+
+
+class TestConditionalGet(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        self.client2.force_login(self.user_tom)
+        self.urls = (
+            reverse('index'),
+            reverse('group', args=(self.group_cats.slug,)),
+            reverse('profile', args=(self.user_jerry,)),
+            reverse('post', args=(self.user_jerry, self.post.pk)),
+        )
+
+    def revalidate(self, client, url, response):
+        return client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_repeat_visit_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Cookie', response['Vary'])
+                response = self.revalidate(self.client, url, response)
+                self.assertEqual(response.status_code, 304)
+
+    def test_validators_change_on_write(self):
+        responses = {url: self.client.get(url) for url in self.urls}
+        with self.committed():
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text='Meow'
+            )
+        for url, response in responses.items():
+            with self.subTest(url=url):
+                response = self.revalidate(self.client, url, response)
+                self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since_alone_not_trusted(self):
+        response = self.client.get(self.urls[-1])
+        self.assertNotIn('Last-Modified', response)
+        Comment.objects.create(
+            post=self.post, author=self.user_tom, text='Meow'
+        )
+        response = self.client.get(
+            self.urls[-1], HTTP_IF_MODIFIED_SINCE=http_date()
+        )
+        self.assertContains(response, 'Meow')
+
+    def test_validators_depend_on_user(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    self.revalidate(self.client2, url, response).status_code,
+                    200,
+                )
+                self.assertEqual(
+                    self.revalidate(Client(), url, response).status_code,
+                    200,
+                )
+
+
+class TestAnonymousPageCache(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        cache.clear()
+        self.post = self.create_post()
+        self.index = reverse('index')
+        self.group = reverse('group', args=(self.group_cats.slug,))
+        self.post_url = reverse('post', args=(self.user_jerry, self.post.pk))
+
+    def assert_cached(self, url, cached=True):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client2.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(not queries.captured_queries, cached)
+        return response
+
+    def test_anonymous_pages_cached_with_keys(self):
+        for url in (self.index, self.group, self.post_url):
+            with self.subTest(url=url):
+                response = self.assert_cached(url, cached=False)
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('s-maxage', response['Cache-Control'])
+                keys = response['Surrogate-Key'].split()
+                self.assertIn(f'post-{self.post.pk}', keys)
+                self.assertIn(f'author-{self.user_jerry.pk}', keys)
+                self.assertIn(f'group-{self.group_cats.pk}', keys)
+                self.assert_cached(url)
+        self.assertIn('feed', self.client2.get(self.index)['Surrogate-Key'])
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.get(self.index)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.index)
+        self.assertTrue(queries.captured_queries)
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+
+    def test_changes_purge_pages(self):
+        for url in (self.index, self.group, self.post_url):
+            self.assert_cached(url, cached=False)
+        with self.committed():
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text='M'
+            )
+        for url in (self.index, self.group, self.post_url):
+            with self.subTest(url=url):
+                self.assert_cached(url, cached=False)
+        self.group_cats.title = 'Kittens'
+        with self.committed():
+            self.group_cats.save()
+        self.assertContains(self.assert_cached(self.index, False), 'Kittens')
+
+    def test_unrelated_changes_keep_pages(self):
+        self.assert_cached(self.group, cached=False)
+        self.assert_cached(self.post_url, cached=False)
+        Post.objects.create(
+            text='Woof', author=self.user_tom, group=self.group_dogs
+        )
+        self.assert_cached(self.group)
+        self.assert_cached(self.post_url)
+        self.assert_cached(self.index, cached=False)
+
+    def test_edge_kept_short_without_purge_backend(self):
+        response = self.client2.get(self.post_url)
+        self.assertIn(
+            f's-maxage={pagecache.PAGE_CACHE_MAX_AGE}',
+            response['Cache-Control'],
+        )
+
+    def test_purge_backend_called_after_commit(self):
+        backend = mock.Mock()
+        with mock.patch.object(
+            pagecache, 'edge_backend', return_value=backend
+        ), mock.patch(
+            'posts.pagecache.transaction.on_commit',
+            side_effect=lambda func: func(),
+        ):
+            response = self.client2.get(self.post_url)
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text='M'
+            )
+        self.assertIn(
+            f's-maxage={pagecache.PAGE_CACHE_TIMEOUT}',
+            response['Cache-Control'],
+        )
+        backend.assert_called_once_with([f'post-{self.post.pk}'])
+
+
+class TestInvalidationAfterCommit(TransactionTestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+
+    def test_bumped_and_purged_after_commit(self):
+        generation = get_generation()
+        keys = ['feed', f'post-{self.post.pk}']
+        versions = pagecache.key_versions(keys)
+        with transaction.atomic():
+            Comment.objects.create(
+                post=self.post, author=self.user_tom, text='Meow'
+            )
+            self.create_post()
+            # читатель до коммита видит старые строки и старые версии
+            self.assertEqual(get_generation(), generation)
+            self.assertEqual(pagecache.key_versions(keys), versions)
+        self.assertGreater(get_generation(), generation)
+        for key, version in pagecache.key_versions(keys).items():
+            with self.subTest(key=key):
+                self.assertGreater(version, versions[key])
+
+
+class TestTransfer(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        Post.objects.create(text='Без группы', author=self.user_tom)
+        Comment.objects.create(
+            post=self.post, author=self.user_tom, text='Meow'
+        )
+        Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def export(self, kind, fmt):
+        path = os.path.join(self.dir.name, f'{kind}.{fmt}')
+        with mock.patch('sys.stderr', StringIO()):
+            call_command('export_posts', path, kind=kind)
+        return path
+
+    def round_trip(self, fmt):
+        pub_date = self.post.pub_date
+        paths = {
+            kind: self.export(kind, fmt)
+            for kind in ('posts', 'comments', 'follows')
+        }
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        User.objects.filter(username='tom').delete()
+        self.group_cats.delete()
+        for kind, path in paths.items():
+            call_command(
+                'import_posts', path, kind=kind, batch_size=1,
+                stdout=StringIO(),
+            )
+
+        self.assertEqual(Post.objects.count(), 2)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.comment_count, 1)
+        tom = User.objects.get(username='tom')
+        self.assertFalse(tom.has_usable_password())
+        self.assertEqual(tom.stats.posts_count, 1)
+        self.assertEqual(tom.stats.following_count, 1)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.user_jerry).followers_count, 1
+        )
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=tom, post=post).exists()
+        )
+        self.assertEqual(
+            [found.pk for found in search.search('lets')], [post.pk]
+        )
+
+    def test_round_trip_jsonl(self):
+        self.round_trip('jsonl')
+
+    def test_round_trip_csv(self):
+        self.round_trip('csv')
+
+    def test_import_is_repeatable(self):
+        path = self.export('posts', 'jsonl')
+        call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_export_to_stdout(self):
+        out = StringIO()
+        with mock.patch('sys.stderr', StringIO()):
+            call_command('export_posts', kind='follows', stdout=out)
+        self.assertEqual(
+            out.getvalue(), '{"user": "tom", "author": "jerry"}\n'
+        )
+
+
+class TestFollowBatch(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        cache.clear()
+        self.user_spike = User.objects.create_user(username='spike')
+        self.post = self.create_post()
+        self.url = reverse('follow_batch')
+
+    def post_json(self, data):
+        return self.client2.post(
+            self.url, json.dumps(data), content_type='application/json'
+        )
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_batch_follow_and_unfollow(self):
+        self.client2.force_login(self.user_tom)
+        response = self.post_json(
+            {'follow': ['jerry', 'spike', 'tom', 'nobody']}
+        )
+        self.assertEqual(
+            response.json(), {'followed': ['jerry', 'spike'], 'unfollowed': []}
+        )
+        self.assertEqual(self.stats(self.user_tom).following_count, 2)
+        self.assertEqual(self.stats(self.user_jerry).followers_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user_tom, post=self.post
+        ).exists())
+
+        response = self.client2.post(
+            self.url, {'follow': ['spike'], 'unfollow': ['jerry']}
+        )
+        self.assertEqual(
+            response.json(), {'followed': [], 'unfollowed': ['jerry']}
+        )
+        self.assertEqual(
+            list(Follow.objects.filter(user=self.user_tom).values_list(
+                'author__username', flat=True
+            )),
+            ['spike'],
+        )
+        self.assertEqual(self.stats(self.user_tom).following_count, 1)
+        self.assertEqual(self.stats(self.user_jerry).followers_count, 0)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user_tom))
+
+    def test_batch_counts_inserted_rows(self):
+        self.client2.force_login(self.user_tom)
+        bulk_create = Follow.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # параллельный запрос успел подписать tom на jerry
+            Follow.objects.create(user=self.user_tom, author=self.user_jerry)
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(
+            Follow.objects, 'bulk_create', racing_bulk_create
+        ):
+            self.post_json({'follow': ['jerry', 'spike']})
+        self.assertEqual(self.stats(self.user_tom).following_count, 2)
+        self.assertEqual(self.stats(self.user_jerry).followers_count, 1)
+        self.assertEqual(self.stats(self.user_spike).followers_count, 1)
+
+    def test_batch_limits(self):
+        self.client2.force_login(self.user_tom)
+        self.assertEqual(self.client2.get(self.url).status_code, 405)
+        with mock.patch.object(follows, 'MAX_BATCH', 1):
+            response = self.post_json({'follow': ['jerry', 'spike']})
+        self.assertEqual(response.status_code, 400)
+        with mock.patch.object(follows, 'RATE_LIMIT', 2):
+            self.assertEqual(
+                self.post_json({'follow': ['jerry']}).status_code, 200
+            )
+            response = self.post_json({'follow': ['spike', 'jerry']})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(Follow.objects.filter(author=self.user_spike))
+
+    def test_batch_rejects_malformed_json(self):
+        self.client2.force_login(self.user_tom)
+        for data in (
+            {'follow': 'jerry'}, {'unfollow': ['jerry', 5]},
+            {'follow': {'jerry': 1}}, ['jerry'],
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.post_json(data).status_code, 400)
+        response = self.client2.post(
+            self.url, '{', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_batch_requires_login(self):
+        response = self.post_json({'follow': ['jerry']})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Follow.objects.exists())
+
+
+class TestRecommendations(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.spike = User.objects.create_user(username='spike')
+        self.butch = User.objects.create_user(username='butch')
+        self.mike = User.objects.create_user(username='mike')
+        for user, author in (
+            (self.user_tom, self.user_jerry),
+            (self.user_jerry, self.spike),
+            (self.mike, self.user_jerry),
+            (self.mike, self.butch),
+        ):
+            Follow.objects.create(user=user, author=author)
+
+    def test_graph_recommendations(self):
+        graph = recommendations.FollowGraph(
+            Follow.objects.values_list('user_id', 'author_id')
+        )
+        tom = list(graph.ids).index(self.user_tom.pk)
+        found = {
+            graph.ids[author]: score
+            for score, author in graph.recommend(tom)
+        }
+        # spike — друг друга, butch — у соподписчика mike
+        self.assertEqual(
+            found,
+            {self.spike.pk: recommendations.FRIEND_WEIGHT, self.butch.pk: 1},
+        )
+
+    def test_command_stores_and_views_read(self):
+        call_command('compute_recommendations', stdout=StringIO())
+        self.assertEqual(
+            list(Recommendation.objects.filter(
+                user=self.user_tom
+            ).values_list('author__username', flat=True)),
+            ['spike', 'butch'],
+        )
+        with self.assertNumQueries(1):
+            found = recommendations.for_user(self.user_tom)
+            self.assertEqual(found[0].author.username, 'spike')
+        self.client2.force_login(self.user_tom)
+        for url in (reverse('follow_index'),
+                    reverse('profile', args=(self.user_jerry,))):
+            with self.subTest(url=url):
+                response = self.client2.get(url)
+                self.assertEqual(
+                    response.context['recommendations'], found
+                )
+                self.assertContains(response, '@spike')
+
+        Follow.objects.create(user=self.user_tom, author=self.spike)
+        self.assertEqual(
+            [rec.author for rec in recommendations.for_user(self.user_tom)],
+            [self.butch],
+        )
+        self.assertEqual(recommendations.for_user(AnonymousUser()), [])
+
+
+class TestLookups(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        cache.clear()
+
+    def test_lookups_hit_cache(self):
+        group = lookups.get_group('cats')
+        author = lookups.get_user('jerry')
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get_group('cats'), group)
+            self.assertEqual(lookups.get_user('jerry'), author)
+            self.assertEqual(author.get_full_name(), 'Jerry Mouse')
+        lookups.get_user('tom')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('profile_follow', args=('tom',)))
+        self.assertTrue(Follow.objects.filter(author=self.user_tom).exists())
+        self.assertFalse(any(
+            'FROM "auth_user" WHERE "auth_user"."username"' in query['sql']
+            for query in queries
+        ))
+
+    def test_missing_records(self):
+        with self.assertRaises(Http404):
+            lookups.get_group('birds')
+        with self.assertRaises(Http404):
+            lookups.get_user('spike')
+        response = self.client.get(reverse('group', args=('birds',)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_rename_invalidates(self):
+        lookups.get_group('cats')
+        lookups.get_user('tom')
+        self.group_cats.slug = 'kittens'
+        self.user_tom.username = 'thomas'
+        with self.committed():
+            self.group_cats.save()
+            self.user_tom.save()
+            # до коммита записи остаются: старая строка ещё видна другим
+            self.assertIsNotNone(cache.get(lookups.user_key('tom')))
+            self.assertIsNotNone(cache.get(lookups.group_key('cats')))
+        with self.assertRaises(Http404):
+            lookups.get_group('cats')
+        with self.assertRaises(Http404):
+            lookups.get_user('tom')
+        self.assertEqual(lookups.get_group('kittens').pk, self.group_cats.pk)
+        self.assertEqual(lookups.get_user('thomas').pk, self.user_tom.pk)
+
+    def test_delete_and_update_invalidate(self):
+        lookups.get_user('tom')
+        self.user_tom.first_name = 'Thomas'
+        with self.committed():
+            self.user_tom.save()
+        self.assertEqual(lookups.get_user('tom').first_name, 'Thomas')
+        with self.committed():
+            self.group_dogs.delete()
+            self.user_tom.delete()
+        response = self.client.get(reverse('group', args=('dogs',)))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('profile', args=('tom',)))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_cache_filled_from_primary(self):
+        with mock.patch(
+            'yatube.routers.reading_from_replica', return_value=True
+        ), mock.patch('yatube.routers.random.choice') as choice:
+            lookups.get_user('tom')
+            lookups.get_group('cats')
+            with self.assertRaises(Http404):
+                lookups.get_group('birds')
+        choice.assert_not_called()
+
+    def test_login_keeps_cached_user(self):
+        lookups.get_user('tom')
+        self.client2.login(username='tom', password='A12345a!')
+        with self.assertNumQueries(0):
+            lookups.get_user('tom')
+
+
+class TestMissingLookups(TestCase, HelperTest):
+    def setUp(self):
+        self.setInit()
+        self.post = self.create_post()
+        cache.clear()
+        lookups.usernames.rebuild()
+
+    def test_bloom_filter(self):
+        bloom = lookups.BloomFilter(1000)
+        names = [f'user{number}' for number in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(
+            f'stranger{number}' in bloom for number in range(1000)
+        )
+        self.assertLess(false_positives, 50)
+
+    def test_unknown_username_without_queries(self):
+        for url in ('/wp-login.php/', '/admin.php/5/', '/spike/5/comments/'):
+            with self.assertNumQueries(0):
+                response = self.client2.get(url)
+            self.assertEqual(response.status_code, 404)
+
+    def test_missing_post_cached(self):
+        url = reverse('post', args=('jerry', self.post.pk + 100))
+        response = self.client2.get(url)
+        self.assertEqual(response.status_code, 404)
+        with self.assertNumQueries(0):
+            response = self.client2.get(url)
+        self.assertEqual(response.status_code, 404)
+        with self.committed():
+            Post.objects.create(
+                pk=self.post.pk + 100, text='Later', author=self.user_jerry
+            )
+            # до коммита другие запросы новую запись ещё не видят
+            self.assertEqual(self.client2.get(url).status_code, 404)
+        self.assertEqual(self.client2.get(url).status_code, 200)
+
+    def test_signup_updates_filter(self):
+        self.assertEqual(self.client2.get('/spike/').status_code, 404)
+        self.client2.post(reverse('signup'), {
+            'username': 'spike',
+            'email': 'spike@disney.com',
+            'password1': 'Bulldog12345!',
+            'password2': 'Bulldog12345!',
+        })
+        self.assertTrue(lookups.usernames.might_exist('spike'))
+        self.assertEqual(self.client2.get('/spike/').status_code, 200)
+
+    def test_filter_rebuilt_on_version_change(self):
+        User.objects.bulk_create([User(username='butch')])
+        self.assertFalse(lookups.usernames.might_exist('butch'))
+        lookups.usernames_changed()
+        self.assertTrue(lookups.usernames.might_exist('butch'))
+
+    def test_other_process_adds_published_names(self):
+        version = lookups.usernames_changed()
+        other = lookups.UsernameFilter()
+        other.rebuild(version)
+        User.objects.create_user(username='butch')
+        with self.assertNumQueries(0):
+            self.assertTrue(other.might_exist('butch'))
+        User.objects.create_user(username='spike')
+        cache.delete(lookups.username_key(version + 2))
+        with self.assertNumQueries(1):
+            self.assertTrue(other.might_exist('spike'))
+
+    def test_version_bumped_on_create_and_rename_only(self):
+        version = lookups.usernames_changed()
+        self.user_jerry.first_name = 'Jerry'
+        self.user_jerry.save()
+        self.assertEqual(cache.get(lookups.USERNAMES_VERSION_KEY), version)
+        self.user_jerry.username = 'jerry_mouse'
+        self.user_jerry.save()
+        self.assertEqual(
+            cache.get(lookups.USERNAMES_VERSION_KEY), version + 1
+        )
+        self.assertTrue(lookups.usernames.might_exist('jerry_mouse'))
+
+
 class TestErrors(TestCase):
     def test_404(self):
         client = Client()
@@ -0,0 +1,74 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+
+from yatube import timing
+
+logger = logging.getLogger(__name__)
+
+# Должны совпадать с {% thumbnail %} в include/post_item.html
+THUMBNAIL_SIZES = getattr(settings, 'POST_THUMBNAIL_SIZES', (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+))
+THUMBNAIL_WORKERS = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+
+_executor = None
+_lock = threading.Lock()
+_pending = 0
+
+
+class TimedThumbnailBackend(ThumbnailBackend):
+    """Время {% thumbnail %} и generate() попадает в замеры запроса."""
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        with timing.timer('thumbnail'):
+            return super().get_thumbnail(file_, geometry_string, **options)
+
+
+def generate(name):
+    """Создаёт все размеры миниатюр для файла из MEDIA_ROOT."""
+    for geometry, options in THUMBNAIL_SIZES:
+        get_thumbnail(name, geometry, **options)
+    return name
+
+
+def _run(name):
+    global _pending
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        close_old_connections()
+        with _lock:
+            _pending -= 1
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def schedule(name):
+    """Ставит файл в очередь фоновых воркеров, не задерживая запрос."""
+    global _pending
+    if not name:
+        return
+    with _lock:
+        _pending += 1
+    get_executor().submit(_run, name)
+
+
+def queue_depth():
+    return _pending
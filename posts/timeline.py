@@ -0,0 +1,244 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .paginator import (AFTER, CursorPage, InvalidCursor, decode_cursor,
+                        encode_cursor)
+from .queries import feed_posts
+
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+BACKFILL_LIMIT = getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 1000)
+BATCH_SIZE = 500
+
+
+def is_celebrity(author_id):
+    """Авторам с большим числом подписчиков ленты не рассылаются."""
+    return AuthorStats.objects.filter(
+        user_id=author_id, followers_count__gt=FANOUT_LIMIT
+    ).exists()
+
+
+def skip_celebrity(author_id):
+    """
+    True, если записи автора не раскладываются. Автор помечается
+    timeline_gaps: когда подписчиков станет меньше лимита, ленты
+    продолжат читать его записи при запросе до rebuild().
+    """
+    if not is_celebrity(author_id):
+        return False
+    AuthorStats.objects.filter(
+        user_id=author_id, timeline_gaps=False
+    ).update(timeline_gaps=True)
+    return True
+
+
+def fan_out(post):
+    """Раскладывает новую запись по лентам подписчиков автора."""
+    if skip_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in followers.iterator()
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика последние записи автора."""
+    if skip_celebrity(author_id):
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).order_by('-pub_date').values_list('pk', 'pub_date')[:BACKFILL_LIMIT]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for pk, pub_date in posts
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+REBUILD_SQL = """
+    {insert} {timeline} (user_id, post_id, pub_date)
+    SELECT follow.user_id, post.id, post.pub_date
+    FROM {follow} follow
+    INNER JOIN (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS position
+        FROM {post}
+        WHERE author_id IN (
+            SELECT author_id FROM {follow} WHERE user_id IN ({users})
+        )
+    ) post ON post.author_id = follow.author_id
+    WHERE follow.user_id IN ({users}) AND post.position <= %s
+    AND NOT EXISTS (
+        SELECT 1 FROM {stats} stats
+        WHERE stats.user_id = follow.author_id AND stats.followers_count > %s
+    )
+    {suffix}
+"""
+
+
+def rebuild_batch(user_ids):
+    """
+    Ленты пачки пользователей одним INSERT ... SELECT: последние
+    BACKFILL_LIMIT записей каждого автора, на которого они подписаны,
+    кроме знаменитостей, как backfill().
+    """
+    AuthorStats.objects.filter(
+        followers_count__gt=FANOUT_LIMIT, timeline_gaps=False,
+        user__following__user_id__in=user_ids,
+    ).update(timeline_gaps=True)
+    ops = connection.ops
+    sql = REBUILD_SQL.format(
+        insert=ops.insert_statement(ignore_conflicts=True),
+        suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+        timeline=ops.quote_name(TimelineEntry._meta.db_table),
+        follow=ops.quote_name(Follow._meta.db_table),
+        post=ops.quote_name(Post._meta.db_table),
+        stats=ops.quote_name(AuthorStats._meta.db_table),
+        users=', '.join(['%s'] * len(user_ids)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql, [*user_ids, *user_ids, BACKFILL_LIMIT, FANOUT_LIMIT]
+        )
+
+
+def rebuild(user_ids=None):
+    """
+    Собирает ленты заново пачками по BATCH_SIZE пользователей.
+    Полная сборка раскладывает и записи авторов с пропусками, которые
+    больше не знаменитости, и снимает с них timeline_gaps.
+    """
+    follows = Follow.objects.order_by('user_id')
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+    if user_ids is None:
+        AuthorStats.objects.filter(
+            timeline_gaps=True, followers_count__lte=FANOUT_LIMIT
+        ).update(timeline_gaps=False)
+    entries.delete()
+    users = list(follows.values_list('user_id', flat=True).distinct())
+    for start in range(0, len(users), BATCH_SIZE):
+        rebuild_batch(users[start:start + BATCH_SIZE])
+
+
+def read_time_authors(user):
+    """Авторы, чьи записи лента читает при запросе, а не из TimelineEntry."""
+    return list(
+        Follow.objects.filter(user=user).filter(
+            Q(author__stats__followers_count__gt=FANOUT_LIMIT)
+            | Q(author__stats__timeline_gaps=True)
+        ).values_list('author_id', flat=True)
+    )
+
+
+def after(queryset, value, pk, pk_field):
+    return queryset.filter(
+        Q(pub_date__lt=value) | Q(pub_date=value, **{pk_field + '__lt': pk})
+    )
+
+
+def before(queryset, value, pk, pk_field):
+    return queryset.filter(
+        Q(pub_date__gt=value) | Q(pub_date=value, **{pk_field + '__gt': pk})
+    ).order_by('pub_date', pk_field)
+
+
+class FeedPosts:
+    """
+    Лента подписок для FeedPaginator. Строки
+    (pub_date, post_id) читаются по индексу timeline_user_date_post_idx,
+    к ним сливаются записи авторов из read_time_authors() по индексу
+    post_author_date_idx, затем записи страницы загружаются по id.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.authors = read_time_authors(user)
+
+    def entries(self):
+        return TimelineEntry.objects.filter(user=self.user).order_by(
+            '-pub_date', '-post_id'
+        ).values_list('pub_date', 'post_id')
+
+    def author_posts(self):
+        return Post.objects.filter(author_id__in=self.authors).order_by(
+            '-pub_date', '-id'
+        ).values_list('pub_date', 'id')
+
+    def rows(self, limit, cursor=None):
+        """Не больше limit строк от начала ленты или от курсора,
+        в порядке удаления от него."""
+        entries, posts = self.entries(), self.author_posts()
+        direction = AFTER
+        if cursor is not None:
+            direction, value, pk = cursor
+            move = after if direction == AFTER else before
+            entries = move(entries, value, pk, 'post_id')
+            posts = move(posts, value, pk, 'id')
+        rows = set(entries[:limit])
+        if self.authors:
+            rows.update(posts[:limit])
+        return sorted(rows, reverse=direction == AFTER)[:limit]
+
+    def load(self, rows):
+        posts = feed_posts().in_bulk([pk for pub_date, pk in rows])
+        return [posts[pk] for pub_date, pk in rows if pk in posts]
+
+
+class FeedPaginator:
+    """Лента подписок по курсору (pub_date, post_id), как CursorPaginator."""
+
+    def __init__(self, feed, per_page):
+        self.feed = feed
+        self.per_page = int(per_page)
+
+    def cursor_for(self, direction, obj):
+        return encode_cursor(direction, obj, 'pub_date')
+
+    def head(self):
+        return self.feed.load(self.feed.rows(self.per_page + 1))
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor) if cursor else None
+        rows = self.feed.rows(self.per_page + 1, decoded)
+        if decoded and not rows:
+            return self.page()
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if decoded is None or decoded[0] == AFTER:
+            return CursorPage(
+                self.feed.load(rows), self, cursor,
+                has_next=has_more, has_previous=decoded is not None,
+            )
+        rows.reverse()
+        return CursorPage(
+            self.feed.load(rows), self, cursor,
+            has_next=True, has_previous=has_more,
+        )
+
+    def get_page(self, cursor=None):
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
@@ -1,31 +1,57 @@
+import json
 from datetime import datetime
+from urllib.parse import urlencode
 
-from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.vary import vary_on_cookie
 
+from yatube.sqlite import retry_on_locked
+
+from . import follows, lookups, recommendations, search, thumbnails
+from .cache import feed_cache_context, page_etag
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post
+from .models import Follow, Post
+from .pagecache import anonymous_page_cache, object_keys, set_surrogate_keys
+from .paginator import CursorPaginator, InvalidCursor, first_page
+from .queries import COMMENTS_PER_PAGE, feed_posts, post_detail
+from .timeline import FeedPaginator, FeedPosts
+
 
-User = get_user_model()
+FOLLOW_KEYS = ('follow', 'unfollow')
 
 
+@vary_on_cookie
+@condition(etag_func=page_etag)
+@anonymous_page_cache
 def index(request):
-    post_list = Post.objects.select_related(
-        'author', 'group'
+    post_list = feed_posts()
+    return paginator_render(
+        request, 'index.html', {}, post_list, cache_feed=True,
+        surrogate_keys={'feed'},
     )
-    return paginator_render(request, 'index.html', {}, post_list)
 
 
+@vary_on_cookie
+@condition(etag_func=page_etag)
+@anonymous_page_cache
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    return paginator_render(request, 'group.html', {'group': group}, post_list)
+    group = lookups.get_group(slug)
+    post_list = feed_posts(group=group)
+    return paginator_render(
+        request, 'group.html', {'group': group}, post_list,
+        surrogate_keys={f'group-{group.pk}'},
+    )
 
 
 @login_required
+@retry_on_locked
 def new_post(request):
     context = {'new_or_edit': ('Добавить запись', 'Добавить'), }
     if not request.method == 'POST':
@@ -40,35 +66,74 @@ def new_post(request):
     if form.is_valid():
         form_commit = form.save(commit=False)
         form_commit.author = request.user
-        form_commit.save()
+        with transaction.atomic():
+            form_commit.save()
+            schedule_thumbnails(form_commit)
         return redirect('index')
     return render(request, 'new.html', context)
 
 
+@vary_on_cookie
+@condition(etag_func=page_etag)
+@anonymous_page_cache
 def profile(request, username):
-    author = get_object_or_404(get_user_model(), username=username)
-    posts = author.posts.all()
+    author = lookups.get_user(username)
+    posts = feed_posts(author=author)
     following = is_following(request.user, author)
     template = 'profile.html'
     context = {
         'following': following,
         'author': author,
+        'recommendations': recommendations.for_user(request.user),
     }
-    return paginator_render(request, template, context, posts)
+    return paginator_render(
+        request, template, context, posts,
+        surrogate_keys={f'author-{author.pk}'},
+    )
 
 
+@vary_on_cookie
+@condition(etag_func=page_etag)
+@anonymous_page_cache
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
-    comments = post.comments.all()
-    following = is_following(request.user, post.author)
-    form = CommentForm(request.POST)
-    context = {
-        'post': post,
-        'following': following,
-        'form': form,
-        'comments': comments,
-    }
-    return paginator_render(request, 'post.html', context, comments)
+    author = lookups.get_user(username)
+    context = post_detail(
+        author, post_id, request.user, request.GET.get('cursor')
+    )
+    context['form'] = CommentForm()
+    response = render(request, 'post.html', context)
+    keys = object_keys(context['post'])
+    for comment in context['page']:
+        keys |= object_keys(comment)
+    return set_surrogate_keys(response, keys)
+
+
+def post_comments(request, username, post_id):
+    """Страница комментариев по курсору для подгрузки на странице записи."""
+    author = lookups.get_user(username)
+    post = lookups.get_post(Post.objects.only('pk'), author, post_id)
+    paginator = CursorPaginator(
+        post.comments.select_related('author'), COMMENTS_PER_PAGE
+    )
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Неверный курсор'}, status=400)
+    return JsonResponse({
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in page
+        ],
+        'html': render_to_string(
+            'include/comment_list.html', {'comments': page}, request
+        ),
+        'next_cursor': page.next_cursor,
+    })
 
 
 def is_following(user, author):
@@ -78,10 +143,12 @@ def is_following(user, author):
     return following
 
 
+@retry_on_locked
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
+    author = lookups.get_user(username)
+    post = lookups.get_post(Post.objects.all(), author, post_id)
     url = redirect('post', username, post_id)
-    if not request.user == post.author:
+    if not request.user == author:
         return url
 
     form = PostForm(
@@ -96,63 +163,153 @@ def post_edit(request, username, post_id):
     }
 
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            schedule_thumbnails(form.save())
         return url
     return render(request, 'new.html', context)
 
 
 @login_required
+@retry_on_locked
 def add_comment(request, username, post_id):
     url = redirect('post', username, post_id)
     if not request.POST:
         return url
-    post = get_object_or_404(Post, author__username=username, pk=post_id)
+    author = lookups.get_user(username)
+    post = lookups.get_post(Post.objects.all(), author, post_id)
     form = CommentForm(request.POST)
     context = {'form': form}
     if form.is_valid():
         form_commit = form.save(commit=False)
         form_commit.post = post
         form_commit.author = request.user
-        form_commit.save()
+        with transaction.atomic():
+            form_commit.save()
         return url
     return render(request, 'post.html', context)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.select_related(
-        'author', 'group'
-    ).filter(
-        author__following__user=request.user
-    )
-    return paginator_render(request, 'follow.html', {}, posts)
+    paginator = FeedPaginator(FeedPosts(request.user), 10)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        page = paginator.get_page(cursor)
+    else:
+        paginator, page = first_page(paginator)
+    context = {
+        'recommendations': recommendations.for_user(request.user),
+        'paginator': paginator,
+        'page': page,
+    }
+    context.update(feed_cache_context(page))
+    return render(request, 'follow.html', context)
+
+
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(search.search(query, feed_posts()), 10)
+    page = paginator.get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&',
+        'paginator': paginator,
+        'page': page,
+    }
+    return render(request, 'search.html', context)
 
 
 @login_required
+@retry_on_locked
 def profile_follow(request, username):
     follower = request.user
-    following = get_object_or_404(User, username=username)
+    following = lookups.get_user(username)
     if not username == follower.username:
-        Follow.objects.get_or_create(author=following, user=follower)
+        with transaction.atomic():
+            Follow.objects.get_or_create(author=following, user=follower)
     return redirect('profile', username)
 
 
 @login_required
+@retry_on_locked
 def profile_unfollow(request, username):
     follower = request.user
-    following = get_object_or_404(User, username=username)
+    following = lookups.get_user(username)
     object_exists = Follow.objects.filter(user=follower, author=following)
-    object_exists.delete()
+    with transaction.atomic():
+        object_exists.delete()
     return redirect('profile', username)
 
 
-def paginator_render(request, template, context, queryset, num_items=10):
-    paginator = Paginator(queryset, num_items)
-    page = paginator.get_page(request.GET.get('page'))
+@login_required
+@require_POST
+@retry_on_locked
+def follow_batch(request):
+    """
+    Пакетная подписка: JSON {"follow": [...], "unfollow": [...]}
+    или те же поля формой, значения — username авторов.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+            names = {key: data.get(key, []) for key in FOLLOW_KEYS}
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Неверный JSON'}, status=400)
+        if not all(is_name_list(value) for value in names.values()):
+            return JsonResponse(
+                {'error': 'Ожидаются списки username'}, status=400
+            )
+    else:
+        names = {key: request.POST.getlist(key) for key in FOLLOW_KEYS}
+    try:
+        followed, unfollowed = follows.apply(request.user, **names)
+    except follows.BatchTooLarge as error:
+        return JsonResponse(
+            {'error': f'Не больше {error.args[0]} авторов за запрос'},
+            status=400,
+        )
+    except follows.RateLimitExceeded as error:
+        response = JsonResponse(
+            {'error': 'Слишком много изменений подписок'}, status=429
+        )
+        response['Retry-After'] = error.retry_after
+        return response
+    return JsonResponse({'followed': followed, 'unfollowed': unfollowed})
+
+
+def is_name_list(value):
+    # строка "alice" иначе превратилась бы в список букв
+    return isinstance(value, list) and all(
+        isinstance(name, str) for name in value
+    )
+
+
+def schedule_thumbnails(post):
+    if post.image:
+        name = post.image.name
+        transaction.on_commit(lambda: thumbnails.schedule(name))
+
+
+def paginator_render(request, template, context, queryset, num_items=10,
+                     cache_feed=False, surrogate_keys=None):
+    paginator = CursorPaginator(queryset, num_items)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        page = paginator.get_page(cursor)
+    else:
+        paginator, page = first_page(paginator)
     context = context
     context['paginator'] = paginator
     context['page'] = page
-    return render(request, template, context)
+    if cache_feed:
+        context.update(feed_cache_context(page))
+    response = render(request, template, context)
+    if surrogate_keys is not None:
+        keys = set(surrogate_keys)
+        for obj in page:
+            keys |= object_keys(obj)
+        set_surrogate_keys(response, keys)
+    return response
 
 
 def page_not_found(request, exception):
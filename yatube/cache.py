@@ -0,0 +1,266 @@
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics, timing
+
+EPOCH_KEY = 'tiered:epoch'
+MESSAGE_KEY = 'tiered:message:%d'
+# Счётчики и версии для инвалидации: процесс не должен видеть
+# устаревшее значение даже INVALIDATION_INTERVAL секунд
+SHARED_ONLY = (
+    'feed:generation', 'post_item:version:', 'surrogate:',
+    'lookup:usernames', 'follow-rate:',
+)
+
+# Локальные уровни общие для всех потоков процесса, как у LocMemCache
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    """LRU в памяти процесса с ограниченным временем жизни записей."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.token = uuid.uuid4().hex
+        self.epoch = None
+        self.next_sync = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            pickled, expires = item
+            if expires is not None and expires <= time.time():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+        return pickled
+
+    def set(self, key, pickled, expires):
+        with self.lock:
+            self.data[key] = (pickled, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кэш: небольшой LRU в памяти процесса перед общим
+    бэкендом из CACHES (Redis, memcached). Пул соединений настраивается
+    у общего бэкенда.
+
+    Каждая запись публикует в общем бэкенде сообщение с изменёнными
+    ключами и увеличивает номер эпохи. Раз в INVALIDATION_INTERVAL
+    секунд процесс читает новые сообщения одним get_many и удаляет
+    эти ключи из своего LRU.
+
+    OPTIONS: SHARED — алиас общего кэша, LOCAL_MAX_ENTRIES,
+    LOCAL_TIMEOUT — сколько секунд запись живёт в LRU,
+    INVALIDATION_INTERVAL, MAX_MESSAGES и MESSAGE_TIMEOUT — сколько
+    сообщений и как долго хранится; отставший процесс очищает LRU.
+    SHARED_ONLY — префиксы ключей, которые в LRU не попадают и всегда
+    читаются из общего кэша.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self.interval = options.get('INVALIDATION_INTERVAL', 1)
+        self.max_messages = options.get('MAX_MESSAGES', 1000)
+        self.message_timeout = options.get('MESSAGE_TIMEOUT', 60)
+        self.shared_only = tuple(options.get('SHARED_ONLY', SHARED_ONLY))
+        with _tiers_lock:
+            self.local = _tiers.setdefault(
+                name, LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000))
+            )
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _local_expiry(self, timeout):
+        expires = time.time() + self.local_timeout
+        backend = self.get_backend_timeout(timeout)
+        return expires if backend is None else min(expires, backend)
+
+    def _remember(self, key, local_key, value, timeout=DEFAULT_TIMEOUT):
+        if key.startswith(self.shared_only):
+            return
+        self.local.set(
+            local_key,
+            pickle.dumps(value, self.pickle_protocol),
+            self._local_expiry(timeout),
+        )
+
+    def _publish(self, keys):
+        """keys=None — сообщение о полной очистке."""
+        try:
+            epoch = self.shared.incr(EPOCH_KEY)
+        except ValueError:
+            self.shared.add(EPOCH_KEY, 0, None)
+            epoch = self.shared.incr(EPOCH_KEY)
+        self.shared.set(
+            MESSAGE_KEY % epoch, (self.local.token, keys),
+            self.message_timeout,
+        )
+        # собственные сообщения процесс уже учёл
+        if self.local.epoch == epoch - 1:
+            self.local.epoch = epoch
+
+    def _sync(self):
+        local = self.local
+        now = time.monotonic()
+        if now < local.next_sync:
+            return
+        local.next_sync = now + self.interval
+        epoch = self.shared.get(EPOCH_KEY, 0)
+        if epoch == local.epoch:
+            return
+        if (local.epoch is None
+                or not 0 < epoch - local.epoch <= self.max_messages):
+            local.clear()
+        else:
+            numbers = range(local.epoch + 1, epoch + 1)
+            messages = self.shared.get_many(
+                [MESSAGE_KEY % number for number in numbers]
+            )
+            if len(messages) < len(numbers):
+                local.clear()
+            for token, keys in messages.values():
+                if token == local.token:
+                    continue
+                if keys is None:
+                    local.clear()
+                else:
+                    local.delete(keys)
+        local.epoch = epoch
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version)
+        self.validate_key(local_key)
+        self._sync()
+        pickled = self.local.get(local_key)
+        if pickled is not None:
+            timing.record_cache(1, 0)
+            metrics.observe_cache(key, True)
+            return pickle.loads(pickled)
+        value = self.shared.get(key, self, version)
+        if value is self:
+            timing.record_cache(0, 1)
+            metrics.observe_cache(key, False)
+            return default
+        timing.record_cache(1, 0)
+        metrics.observe_cache(key, True)
+        self._remember(key, local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found, missing = {}, []
+        for key in keys:
+            pickled = self.local.get(self.make_key(key, version))
+            if pickled is None:
+                missing.append(key)
+            else:
+                found[key] = pickle.loads(pickled)
+        if missing:
+            shared = self.shared.get_many(missing, version)
+            for key, value in shared.items():
+                self._remember(key, self.make_key(key, version), value)
+            found.update(shared)
+        timing.record_cache(len(found), len(keys) - len(found))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_key(key, version)
+        self.validate_key(local_key)
+        self._sync()
+        self.shared.set(key, value, timeout, version)
+        self._remember(key, local_key, value, timeout)
+        self._publish([local_key])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        self._sync()
+        failed = self.shared.set_many(data, timeout, version) or []
+        local_keys = []
+        for key, value in data.items():
+            local_key = self.make_key(key, version)
+            local_keys.append(local_key)
+            if key not in failed:
+                self._remember(key, local_key, value, timeout)
+        self._publish(local_keys)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._sync()
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            local_key = self.make_key(key, version)
+            self._remember(key, local_key, value, timeout)
+            self._publish([local_key])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_key(key, version)
+        self.local.delete([local_key])
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        local_keys = [self.make_key(key, version) for key in keys]
+        if not local_keys:
+            return
+        self._sync()
+        self.shared.delete_many(keys, version)
+        self.local.delete(local_keys)
+        self._publish(local_keys)
+
+    def has_key(self, key, version=None):
+        self._sync()
+        if self.local.get(self.make_key(key, version)) is not None:
+            return True
+        return self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self._sync()
+        value = self.shared.incr(key, delta, version)
+        local_key = self.make_key(key, version)
+        self.local.delete([local_key])
+        self._publish([local_key])
+        return value
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+        self.local.epoch = None
+        self._publish(None)
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
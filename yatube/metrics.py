@@ -0,0 +1,354 @@
+"""
+Метрики в формате Prometheus: гистограммы времени ответа и числа
+SQL-запросов по именам маршрутов posts/urls.py и users/urls.py,
+попадания и промахи фрагментов {% cache %}, очередь миниатюр
+и открытые соединения с базой.
+
+Каждый процесс копит значения в памяти и раз в METRICS_FLUSH_INTERVAL
+секунд записывает их в свой файл <pid>-<uuid>.json в METRICS_DIR:
+повторно выданный pid не перезапишет чужой файл. /metrics складывает
+файлы всех процессов, а файлы завершившихся переносит в aggregate.json
+и удаляет: их счётчики и гистограммы остаются в сумме, gauge — нет.
+Без METRICS_DIR отдаются метрики одного процесса.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+FRAGMENT_PREFIX = 'template.cache.'
+OTHER_VIEW = 'other'
+AGGREGATE_FILE = 'aggregate.json'
+LOCK_FILE = 'aggregate.lock'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HISTOGRAMS = {
+    'yatube_request_duration_seconds': (
+        'Время ответа по маршрутам', DURATION_BUCKETS,
+    ),
+    'yatube_request_queries': (
+        'Число SQL-запросов на ответ по маршрутам', QUERY_BUCKETS,
+    ),
+}
+COUNTERS = {
+    'yatube_fragment_cache_total': (
+        'Обращения к фрагментам {% cache %}: result=hit или miss'
+    ),
+}
+GAUGES = {
+    'yatube_thumbnail_queue_depth': 'Миниатюры в очереди воркеров',
+    'yatube_db_connections': 'Открытые соединения с базой',
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_connections = defaultdict(weakref.WeakSet)
+_last_flush = 0
+_view_names = None
+_process_id = uuid.uuid4().hex
+
+
+def start_process():
+    """Процесс, созданный fork, начинает с пустых значений и своим файлом."""
+    global _process_id, _last_flush
+    _process_id = uuid.uuid4().hex
+    _last_flush = 0
+    _counters.clear()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=start_process)
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def view_label(url_name):
+    """Только имена маршрутов приложений: число рядов ограничено."""
+    global _view_names
+    if _view_names is None:
+        from posts import urls as posts_urls
+        from users import urls as users_urls
+        _view_names = {
+            pattern.name
+            for urls in (posts_urls, users_urls)
+            for pattern in urls.urlpatterns
+        }
+    return url_name if url_name in _view_names else OTHER_VIEW
+
+
+def observe(name, labels, value):
+    """Корзины хранятся накопленными, как в выдаче."""
+    buckets = HISTOGRAMS[name][1]
+    key = (name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = [0] * len(buckets) + [0.0, 0]
+        row = _histograms[key]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                row[index] += 1
+        row[-2] += value
+        row[-1] += 1
+
+
+def inc(name, labels, amount=1):
+    with _lock:
+        _counters[(name, labels)] += amount
+
+
+def observe_request(url_name, duration, queries):
+    labels = (('view', view_label(url_name)),)
+    observe('yatube_request_duration_seconds', labels, duration)
+    observe('yatube_request_queries', labels, queries)
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)
+    if metrics_dir() and time.monotonic() - _last_flush >= interval:
+        flush()
+
+
+def observe_cache(key, hit):
+    """Учитывает ключи фрагментов: template.cache.<имя>.<хэш>."""
+    if enabled() and key.startswith(FRAGMENT_PREFIX):
+        fragment = key[len(FRAGMENT_PREFIX):].rsplit('.', 1)[0]
+        inc('yatube_fragment_cache_total', (
+            ('fragment', fragment), ('result', 'hit' if hit else 'miss'),
+        ))
+
+
+def track_connection(sender, connection, **kwargs):
+    _connections[connection.alias].add(connection)
+
+
+connection_created.connect(track_connection)
+
+
+def gauges():
+    from posts import thumbnails
+    rows = {
+        ('yatube_thumbnail_queue_depth', ()): thumbnails.queue_depth(),
+    }
+    for alias, wrappers in list(_connections.items()):
+        rows[('yatube_db_connections', (('alias', alias),))] = sum(
+            wrapper.connection is not None for wrapper in list(wrappers)
+        )
+    return rows
+
+
+def snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'counters': [
+                [name, labels, value]
+                for (name, labels), value in _counters.items()
+            ],
+            'histograms': [
+                [name, labels, row]
+                for (name, labels), row in _histograms.items()
+            ],
+            'gauges': [
+                [name, labels, value]
+                for (name, labels), value in gauges().items()
+            ],
+        }
+
+
+def process_file():
+    return f'{os.getpid()}-{_process_id}.json'
+
+
+def write_json(path, data):
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def flush():
+    """Записывает значения процесса в METRICS_DIR/<pid>-<uuid>.json."""
+    global _last_flush
+    directory = metrics_dir()
+    if not directory:
+        return
+    _last_flush = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    write_json(os.path.join(directory, process_file()), snapshot())
+
+
+atexit.register(flush)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def merge_dead(directory, snapshots):
+    """
+    Переносит значения завершившихся процессов в aggregate.json и
+    удаляет их файлы; возвращает живые снимки и сумму завершившихся.
+    """
+    dead = {
+        name for name, data in snapshots
+        if data['pid'] != os.getpid() and not is_alive(data['pid'])
+    }
+    path = os.path.join(directory, AGGREGATE_FILE)
+    aggregate = read_json(path) or {
+        'pid': None, 'counters': [], 'histograms': [], 'gauges': [],
+    }
+    if dead:
+        counters, histograms = defaultdict(float), {}
+        add_rows(counters, histograms, aggregate)
+        for name, data in snapshots:
+            if name in dead:
+                add_rows(counters, histograms, data)
+        aggregate['counters'] = [
+            [name, labels, value]
+            for (name, labels), value in counters.items()
+        ]
+        aggregate['histograms'] = [
+            [name, labels, row]
+            for (name, labels), row in histograms.items()
+        ]
+        write_json(path, aggregate)
+        for name in dead:
+            os.remove(os.path.join(directory, name))
+    alive = [data for name, data in snapshots if name not in dead]
+    return alive + [aggregate]
+
+
+def load_snapshots():
+    directory = metrics_dir()
+    if not directory:
+        return [snapshot()]
+    flush()
+    # сборщики /metrics в разных процессах не сливают файлы одновременно
+    with open(os.path.join(directory, LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == AGGREGATE_FILE:
+                continue
+            data = read_json(os.path.join(directory, name))
+            if data is not None:
+                snapshots.append((name, data))
+        return merge_dead(directory, snapshots)
+
+
+def label_key(labels):
+    return tuple(tuple(pair) for pair in labels)
+
+
+def add_rows(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        counters[(name, label_key(labels))] += value
+    for name, labels, row in data['histograms']:
+        key = (name, label_key(labels))
+        total = histograms.setdefault(key, [0] * len(row))
+        for index, value in enumerate(row):
+            total[index] += value
+
+
+def collect():
+    """Сумма по процессам: {(имя, метки): значение или строка гистограммы}."""
+    counters, histograms, gauge_rows = defaultdict(float), {}, defaultdict(int)
+    for data in load_snapshots():
+        add_rows(counters, histograms, data)
+        for name, labels, value in data['gauges']:
+            gauge_rows[(name, label_key(labels))] += value
+    return counters, histograms, gauge_rows
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (
+            key, str(value).replace('\\', r'\\').replace('"', r'\"')
+        )
+        for key, value in pairs
+    )
+
+
+def render():
+    counters, histograms, gauge_rows = collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (row_name, labels), row in sorted(histograms.items()):
+            if row_name != name:
+                continue
+            for bound, value in zip(buckets, row):
+                lines.append(
+                    f'{name}_bucket{format_labels(labels, le=bound)} {value}'
+                )
+            lines.append(
+                f'{name}_bucket{format_labels(labels, le="+Inf")} {row[-1]}'
+            )
+            lines.append(f'{name}_sum{format_labels(labels)} {row[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {row[-1]}')
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (row_name, labels), value in sorted(counters.items()):
+            if row_name == name:
+                lines.append(f'{name}{format_labels(labels)} {value:g}')
+    for name, help_text in GAUGES.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for (row_name, labels), value in sorted(gauge_rows.items()):
+            if row_name == name:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    """
+    Токен METRICS_TOKEN или адрес из METRICS_ALLOWED_IPS; без настроек
+    /metrics закрыт: за локальным nginx REMOTE_ADDR — всегда 127.0.0.1.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if constant_time_compare(header, f'Bearer {token}'):
+            return True
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    return request.META.get('REMOTE_ADDR') in allowed
+
+
+def metrics_view(request):
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,76 @@
+import random
+import threading
+
+from django.conf import settings
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'use_primary'
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def reading_from_replica():
+    return getattr(_state, 'use_replica', False)
+
+
+class ReplicaRouter:
+    """
+    Чтение в отмеченных представлениях идёт на случайную реплику,
+    всё остальное — на основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and replicas():
+            return random.choice(replicas())
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # profile_follow и profile_unfollow пишут и на GET
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики — копии основной базы, связи между ними допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Включает чтение с реплик для представлений из REPLICA_URL_NAMES.
+    После записи — любого запроса, который обращался к базе на запись,
+    а не только POST — клиент получает cookie и ещё
+    REPLICA_STICKY_SECONDS читает с основной базы, чтобы увидеть свои
+    изменения несмотря на отставание реплик.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.use_replica = False
+        if request.method not in SAFE_METHODS or _state.wrote:
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 5),
+                httponly=True,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        url_names = getattr(settings, 'REPLICA_URL_NAMES', ())
+        _state.use_replica = (
+            request.method in SAFE_METHODS
+            and STICKY_COOKIE not in request.COOKIES
+            and request.resolver_match.url_name in url_names
+        )
@@ -50,13 +50,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'posts.pagecache.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'yatube.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -67,7 +70,8 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени отрисовки для Server-Timing
+        'BACKEND': 'yatube.timing.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -87,13 +91,39 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# yatube.sqlite — SQLite с WAL и PRAGMA из yatube/sqlite/base.py;
+# timeout — сколько секунд ждать занятую базу
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'yatube.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': {'mmap_size': 256 * 1024 * 1024},
+        },
     }
 }
 
+# Реплики только для чтения: пути к копиям базы через запятую
+# в DATABASE_REPLICAS. Ленты, профиль и страница записи читаются
+# с реплик, после записи клиент несколько секунд читает с основной базы
+DATABASE_REPLICAS = []
+for number, name in enumerate(
+    filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1
+):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'yatube.sqlite',
+        'NAME': name,
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+REPLICA_URL_NAMES = ('index', 'group', 'profile', 'post', 'follow_index')
+REPLICA_STICKY_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -151,8 +181,110 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 #CACHE
-CACHES = {
-    'default': {
+# Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+# Общий кэш — Redis (REDIS_URL, нужен пакет django-redis) с пулом
+# соединений, memcached (MEMCACHED_LOCATION) или LocMemCache
+# для разработки и тестов
+if os.environ.get('REDIS_URL'):
+    SHARED_CACHE = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'OPTIONS': {
+            'CONNECTION_POOL_KWARGS': {'max_connections': 50},
+        },
+    }
+elif os.environ.get('MEMCACHED_LOCATION'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache',
+        'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        'OPTIONS': {'binary': True, 'behaviors': {'tcp_nodelay': True}},
+    }
+else:
+    SHARED_CACHE = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
-}
\ No newline at end of file
+
+CACHES = {
+    'default': {
+        'BACKEND': 'yatube.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            'INVALIDATION_INTERVAL': 1,
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+
+# Лента подписок: авторам, у которых подписчиков больше лимита,
+# записи в ленты не рассылаются, а читаются при запросе
+TIMELINE_FANOUT_LIMIT = 1000
+TIMELINE_BACKFILL_LIMIT = 1000
+
+# Время жизни кэша лент: фрагменты сбрасываются сигналами при записи
+FEED_CACHE_TIMEOUT = 300
+POST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Страницы для анонимных посетителей: PAGE_CACHE_TIMEOUT — в нашем кэше
+# и в CDN (s-maxage), PAGE_CACHE_MAX_AGE — в браузере.
+# PAGE_CACHE_PURGE_BACKEND — путь к функции, которая получает список
+# Surrogate-Key и сбрасывает их в CDN; без неё s-maxage равен
+# PAGE_CACHE_MAX_AGE
+PAGE_CACHE_TIMEOUT = 300
+PAGE_CACHE_MAX_AGE = 60
+PAGE_CACHE_PURGE_BACKEND = os.environ.get('PAGE_CACHE_PURGE_BACKEND') or None
+
+# Группы по slug и авторы по username: записи сбрасываются сигналами.
+# Несуществующие имена и записи помнятся LOOKUP_NEGATIVE_TIMEOUT секунд
+LOOKUP_CACHE_TIMEOUT = 60 * 60
+LOOKUP_NEGATIVE_TIMEOUT = 60
+
+# Миниатюры загруженных изображений создаются фоновыми потоками
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_BACKEND = 'posts.thumbnails.TimedThumbnailBackend'
+
+# Загружаемые изображения уменьшаются и перекодируются без метаданных
+MAX_UPLOAD_PIXELS = 40 * 1000 * 1000
+MAX_IMAGE_SIDE = 1920
+IMAGE_QUALITY = 85
+
+# Замеры запросов (yatube/timing.py): доля замеряемых запросов
+# и заголовок Server-Timing. Строки JSON пишутся в логгер yatube.timing
+# при PERF_LOG_LEVEL=INFO
+PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE', 1.0))
+PERF_SERVER_TIMING = DEBUG
+
+# Метрики Prometheus на /metrics (yatube/metrics.py). METRICS_DIR —
+# общий каталог процессов gunicorn/uwsgi; без него — метрики процесса.
+# /metrics закрыт, пока не задан METRICS_TOKEN (Authorization: Bearer)
+# или METRICS_ALLOWED_IPS
+METRICS_ENABLED = True
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip
+]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'timing': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'yatube.timing': {
+            'handlers': ['timing'],
+            'level': os.environ.get('PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,37 @@
+"""
+SQLite для продакшена: ENGINE = 'yatube.sqlite'.
+
+Соединение открывается с PRAGMA из OPTIONS['pragmas'] (WAL,
+synchronous=NORMAL, mmap_size, cache_size), транзакции начинаются
+с BEGIN IMMEDIATE, а представления с записью повторяются при
+«database is locked» декоратором retry_on_locked.
+"""
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError
+
+RETRY_ATTEMPTS = getattr(settings, 'SQLITE_RETRY_ATTEMPTS', 3)
+RETRY_DELAY = getattr(settings, 'SQLITE_RETRY_DELAY', 0.05)
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+def retry_on_locked(view):
+    """
+    Повторяет представление, если база занята дольше busy timeout.
+    Ставится снаружи transaction.atomic: повторяется вся транзакция.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            try:
+                return view(request, *args, **kwargs)
+            except OperationalError as error:
+                if not is_locked(error) or attempt == RETRY_ATTEMPTS:
+                    raise
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+    return wrapper
@@ -0,0 +1,34 @@
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,
+    # отрицательное значение — размер в КиБ
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    OPTIONS['pragmas'] дополняют DEFAULT_PRAGMAS,
+    OPTIONS['transaction_mode'] — режим BEGIN (по умолчанию IMMEDIATE:
+    блокировка на запись берётся сразу и ждёт busy timeout, а не падает
+    при попытке повысить блокировку посреди транзакции).
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop('pragmas', {})}
+        self.transaction_mode = kwargs.pop('transaction_mode', 'IMMEDIATE')
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -0,0 +1,177 @@
+"""
+Замеры запроса: число и время SQL, попадания и промахи кэша, время
+отрисовки шаблонов и создания миниатюр. RequestTimingMiddleware
+отдаёт их в заголовке Server-Timing и пишет строкой JSON в логгер
+yatube.timing с именем маршрута (index, group, profile, post, ...).
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+from django.urls import Resolver404, resolve
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+class RequestStats:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.durations = {'template': 0.0, 'thumbnail': 0.0}
+        self.active = set()
+
+
+def current():
+    """Замеры текущего запроса; вне запроса и без выборки — None."""
+    return getattr(_state, 'stats', None)
+
+
+@contextmanager
+def timer(name):
+    """Вложенные замеры одного вида (include внутри шаблона)
+    считаются один раз."""
+    stats = current()
+    if stats is None or name in stats.active:
+        yield
+        return
+    stats.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active.discard(name)
+        stats.durations[name] += time.perf_counter() - started
+
+
+def record_cache(hits, misses):
+    stats = current()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+def sql_timer(execute, sql, params, many, context):
+    """Обёртка connection.execute_wrapper."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = current()
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_time += time.perf_counter() - started
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timer('template'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django с замером времени отрисовки."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def url_name(request):
+    # страницы из AnonymousPageCacheMiddleware отдаются до resolve
+    match = request.resolver_match
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return match.url_name
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestTimingMiddleware:
+    """
+    Замеряет долю PERF_SAMPLE_RATE запросов и все запросы для
+    yatube.metrics, если METRICS_ENABLED. Заголовок Server-Timing
+    добавляется, если PERF_SERVER_TIMING включён; в production его
+    лучше выключить, чтобы не показывать внутренние замеры.
+    Ставится первым в MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'PERF_SAMPLE_RATE', 1.0)
+        sampled = rate >= 1 or rate > 0 and random.random() < rate
+        # метрики считаются по всем запросам, выборка — для логов
+        if not (sampled or metrics.enabled()):
+            return self.get_response(request)
+        stats = _state.stats = RequestStats()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(sql_timer)
+                    )
+                response = self.get_response(request)
+        finally:
+            _state.stats = None
+        total = time.perf_counter() - started
+        name = url_name(request)
+        if metrics.enabled():
+            metrics.observe_request(name, total, stats.sql_count)
+        if not sampled:
+            return response
+        if getattr(settings, 'PERF_SERVER_TIMING', True):
+            response['Server-Timing'] = self.server_timing(stats, total)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'url_name': name,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': milliseconds(total),
+                'sql_count': stats.sql_count,
+                'sql_ms': milliseconds(stats.sql_time),
+                'cache_hits': stats.cache_hits,
+                'cache_misses': stats.cache_misses,
+                'template_ms': milliseconds(stats.durations['template']),
+                'thumbnail_ms': milliseconds(stats.durations['thumbnail']),
+            }))
+        return response
+
+    @staticmethod
+    def server_timing(stats, total):
+        return ', '.join([
+            f'sql;dur={milliseconds(stats.sql_time)};'
+            f'desc="{stats.sql_count} queries"',
+            f'cache;desc="{stats.cache_hits} hits, '
+            f'{stats.cache_misses} misses"',
+            f'template;dur={milliseconds(stats.durations["template"])}',
+            f'thumbnail;dur={milliseconds(stats.durations["thumbnail"])}',
+            f'total;dur={milliseconds(total)}',
+        ])
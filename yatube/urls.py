@@ -20,6 +20,8 @@ from django.contrib import admin
 from django.contrib.flatpages import views
 from django.urls import include, path
 
+from yatube import metrics
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
@@ -42,6 +44,7 @@ urlpatterns = [
         {'url': '/about-spec/'}, name='spec'
     ),
     path('about/', include('django.contrib.flatpages.urls')),
+    path('metrics', metrics.metrics_view, name='metrics'),
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path('', include('posts.urls')),
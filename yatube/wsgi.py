@@ -10,7 +10,19 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
 
 application = get_wsgi_application()
+
+# фильтр username строится при запуске, а не в первом запросе; с текущей
+# версией, чтобы потом добирать новые имена, а не строить его заново
+from django.core.cache import cache  # noqa: E402
+
+from posts.lookups import USERNAMES_VERSION_KEY, usernames  # noqa: E402
+
+try:
+    usernames.rebuild(cache.get(USERNAMES_VERSION_KEY))
+except DatabaseError:
+    pass